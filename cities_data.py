@@ -0,0 +1,505 @@
+# cities_data.py
+import asyncio
+import heapq
+import json
+import logging
+import os
+import pickle
+import random
+import re
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+from difflib import SequenceMatcher
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+DATA_DIR = BASE_DIR / "data"
+WORLD_SOURCE = DATA_DIR / "cities.json"
+RUSSIA_SOURCE = DATA_DIR / "russia-cities.json"
+INDEX_PATH = DATA_DIR / "cities.idx"  # Собранный индекс (генерируется, в git не хранится)
+INDEX_VERSION = 4
+SUGGEST_LIMIT = 3  # Сколько вариантов предлагать при опечатке
+SUGGEST_MIN_SCORE = 0.3  # Порог сходства по триграммам (коэффициент Дайса) для отбора кандидатов
+SUGGEST_MIN_RATIO = 0.7  # Порог посимвольного сходства для итоговой подсказки
+
+RELOAD_CHECK_INTERVAL = 30  # Как часто проверяем, не изменились ли JSON с городами (сек)
+FAMOUS_MIN_COVERAGE = 0.5  # Выбор по населению — только на буквы, где население известно хотя бы у такой доли городов
+ALIAS_ATTEMPTS = 16  # Сколько раз вытягиваем по таблице псевдонимов, прежде чем перестроить её
+
+_SEPARATORS = re.compile(r"[\s\-‐‑–—]+")
+_TRAILING_NOTE = re.compile(r"\s*\([^()]*\)\s*$")  # «Атырау(Гурьев)», «Толука (де Лердо)»
+
+
+def _read_world(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [item["name"].strip() for item in json.load(file)["city"]]
+
+
+def _read_russia(path):
+    """Названия и население городов России"""
+    with open(path, "r", encoding="utf-8") as file:
+        items = json.load(file)
+    return [item["name"].strip() for item in items], [item.get("population") or 0 for item in items]
+
+
+def normalize_name(name):
+    """Нормализуем название для сравнения: регистр, Ё/Е, дефисы и пробелы"""
+    return _SEPARATORS.sub(" ", name.lower().replace("ё", "е")).strip()
+
+
+def name_letter(name):
+    """Первая буква названия, по которой город попадает в корзину"""
+    return normalize_name(name)[:1].upper()
+
+
+def name_end_letter(name):
+    """Буква, на которую должен начинаться следующий город.
+
+    Пояснение в скобках в конце названия не считается, как и 'ъ', 'ь', 'ы'
+    и всё, что не буква.
+    """
+    for char in reversed(normalize_name(_TRAILING_NOTE.sub("", name))):
+        if char.isalpha() and char.upper() not in "ЪЬЫ":
+            return char.upper()
+    return ""
+
+
+def trigrams(name_normalized):
+    padded = f"  {name_normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NamePool:
+    """Общий пул названий: каждое название хранится один раз и получает целый id"""
+
+    def __init__(self):
+        self.names = []  # {id: название из базы}
+        self.ids = {}    # {нормализованное название: id}
+
+    def intern(self, name):
+        key = normalize_name(name)
+        name_id = self.ids.get(key)
+        if name_id is None:
+            name_id = self.ids[key] = len(self.names)
+            self.names.append(name)  # Первое вхождение, как при поиске по списку
+        return name_id
+
+
+def group_by_letter(pool, names):
+    """Раскладываем id названий по первой букве без повторов: {буква: array('I')}"""
+    buckets, seen = {}, set()
+    for name in names:
+        letter = name_letter(name)
+        if not letter:
+            continue
+        name_id = pool.intern(name)
+        if name_id not in seen:
+            seen.add(name_id)
+            buckets.setdefault(letter, array("I")).append(name_id)
+    return buckets
+
+
+def build_index(path=INDEX_PATH):
+    """Собираем компактный индекс из JSON: общий пул названий, id по буквам и население"""
+    started = time.perf_counter()
+    pool = NamePool()
+    russia_names, russia_population = _read_russia(RUSSIA_SOURCE)
+    payload = {
+        "version": INDEX_VERSION,
+        "world": group_by_letter(pool, _read_world(WORLD_SOURCE)),
+        "russia": group_by_letter(pool, russia_names),
+    }
+    population = {}  # {id: население}, только для городов, где оно известно
+    for name, people in zip(russia_names, russia_population):
+        if name and people:
+            name_id = pool.intern(name)
+            population[name_id] = max(population.get(name_id, 0), people)
+    payload["names"] = pool.names
+    payload["population"] = population
+    tmp_path = Path(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")  # Сборки из разных потоков не мешают друг другу
+    with open(tmp_path, "wb") as file:
+        pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)  # Атомарная подмена, чтобы не прочитать недописанный файл
+    logger.info(f"Cities index built in {time.perf_counter() - started:.3f}s: {path}")
+    return payload
+
+
+def _index_is_fresh(path=INDEX_PATH):
+    if not os.path.exists(path):
+        return False
+    index_mtime = os.path.getmtime(path)
+    return all(os.path.getmtime(source) <= index_mtime for source in (WORLD_SOURCE, RUSSIA_SOURCE))
+
+
+def load_index(path=INDEX_PATH):
+    """Читаем индекс, пересобирая его, если JSON новее или формат устарел"""
+    if _index_is_fresh(path):
+        try:
+            with open(path, "rb") as file:
+                payload = pickle.load(file)
+            if payload.get("version") == INDEX_VERSION:
+                return payload
+            logger.info("Cities index has an old format, rebuilding")
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Failed to read cities index, rebuilding: {str(e)}")
+    return build_index(path)
+
+
+def build_alias_table(weights):
+    """Таблица псевдонимов Уолкера (метод Воуза) для выбора по весам за O(1)"""
+    count = len(weights)
+    total = sum(weights)
+    scaled = [weight * count / total for weight in weights]
+    prob, alias = array("d", bytes(8 * count)), array("I", bytes(4 * count))
+    small = [i for i, weight in enumerate(scaled) if weight < 1]
+    large = [i for i, weight in enumerate(scaled) if weight >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less], alias[less] = scaled[less], more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    for i in small + large:  # Остатки из-за погрешности округления
+        prob[i] = 1.0
+    return prob, alias
+
+
+class CityDataset:
+    """Набор городов одного режима поверх общего пула названий.
+
+    buckets — {буква: array('I') id городов}, positions — индекс каждого id
+    в его корзине, чтобы игра могла вычёркивать города без словаря позиций.
+    pair_buckets/pair_positions — то же по паре (первая буква, последняя
+    буква): граф переходов между буквами для сложного бота. alias_tables —
+    таблицы псевдонимов по буквам для выбора с весом по населению. Для подсказок при опечатках по каждой букве лениво строится индекс
+    триграмм {триграмма: array('I') id}.
+    """
+
+    def __init__(self, names, name_ids, buckets, population):
+        self.names = names
+        self.name_ids = name_ids
+        self.buckets = buckets
+        self.population = population
+        # Города без данных о населении считаем самыми маленькими из известных
+        self.default_population = min(population.values(), default=1)
+        self.positions = array("I", bytes(4 * len(names)))
+        self.pair_buckets = {}  # {(первая буква, последняя буква): array('I')}
+        self.pair_positions = array("I", bytes(4 * len(names)))
+        self.end_letters = {}   # {первая буква: (последние буквы)}
+        self._members = bytearray(len(names))
+        self._letters = {}      # {id: первая буква}
+        self._end_letters = {}  # {id: последняя буква}
+        for letter, bucket in buckets.items():
+            for position, name_id in enumerate(bucket):
+                end_letter = name_end_letter(names[name_id])
+                self.positions[name_id] = position
+                self._members[name_id] = 1
+                self._letters[name_id] = letter
+                self._end_letters[name_id] = end_letter
+                pair_bucket = self.pair_buckets.setdefault((letter, end_letter), array("I"))
+                self.pair_positions[name_id] = len(pair_bucket)
+                pair_bucket.append(name_id)
+        for letter, end_letter in self.pair_buckets:
+            self.end_letters.setdefault(letter, []).append(end_letter)
+        self.end_letters = {letter: tuple(ends) for letter, ends in self.end_letters.items()}
+        # Буквы, на которые выбор «известного» города имеет смысл: у остальных население почти неизвестно
+        self.population_letters = frozenset(
+            letter for letter, bucket in buckets.items()
+            if sum(name_id in population for name_id in bucket) >= FAMOUS_MIN_COVERAGE * len(bucket)
+        )
+        self.alias_tables = {
+            letter: (bucket, *build_alias_table([self.weight(name_id) for name_id in bucket]))
+            for letter, bucket in buckets.items()
+        }
+        self._trigrams = {}       # {буква: {триграмма: array('I')}}
+        self._trigram_counts = {}  # {id: число триграмм названия}
+
+    def find(self, city_input):
+        """id города по введённому названию или None"""
+        name_id = self.name_ids.get(normalize_name(city_input))
+        if name_id is None or not self._members[name_id]:
+            return None
+        return name_id
+
+    def name(self, name_id):
+        return self.names[name_id]
+
+    def letter(self, name_id):
+        return self._letters[name_id]
+
+    def end_letter(self, name_id):
+        return self._end_letters[name_id]
+
+    def pair(self, name_id):
+        return self._letters[name_id], self._end_letters[name_id]
+
+    def weight(self, name_id):
+        return self.population.get(name_id, self.default_population)
+
+    def _letter_trigrams(self, letter):
+        postings = self._trigrams.get(letter)
+        if postings is None:
+            postings = defaultdict(lambda: array("I"))
+            for name_id in self.buckets.get(letter, ()):
+                name_trigrams = trigrams(normalize_name(self.names[name_id]))
+                self._trigram_counts[name_id] = len(name_trigrams)
+                for trigram in name_trigrams:
+                    postings[trigram].append(name_id)
+            postings = self._trigrams[letter] = dict(postings)
+        return postings
+
+    def suggest(self, city_input, letter=None, exclude=(), limit=SUGGEST_LIMIT):
+        """Ближайшие по триграммам города на букву (по умолчанию — на первую букву ввода)"""
+        query = normalize_name(city_input)
+        letter = letter or query[:1].upper()
+        postings = self._letter_trigrams(letter)
+        query_trigrams = trigrams(query)
+        common = defaultdict(int)
+        for trigram in query_trigrams:
+            for name_id in postings.get(trigram, ()):
+                common[name_id] += 1
+        scored = []
+        for name_id, count in common.items():
+            if name_id in exclude:
+                continue
+            score = 2 * count / (len(query_trigrams) + self._trigram_counts[name_id])
+            if score >= SUGGEST_MIN_SCORE:
+                scored.append((score, name_id))
+        # Лучших кандидатов по триграммам уточняем посимвольным сравнением
+        matcher = SequenceMatcher(b=query)
+        ranked = []
+        for _, name_id in heapq.nlargest(limit * 4, scored):
+            matcher.set_seq1(normalize_name(self.names[name_id]))
+            ratio = matcher.ratio()
+            if ratio >= SUGGEST_MIN_RATIO:
+                ranked.append((ratio, name_id))
+        return [name_id for _, name_id in heapq.nlargest(limit, ranked)]
+
+
+class _GameBuckets:
+    """Корзины набора, скопированные для одной игры, с вычёркиванием за O(1).
+
+    Корзина копируется при первом обращении. Сыгранный id меняется местами
+    с последним, а сдвинутые позиции запоминаются поверх позиций набора.
+    """
+
+    def __init__(self, source, positions, key_of):
+        self.source = source
+        self.positions = positions
+        self.key_of = key_of
+        self._buckets = {}  # {ключ: array('I') несыгранных id}
+        self._moved = {}    # {id: позиция}, если отличается от positions
+
+    def get(self, key, used):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = array("I", self.source.get(key, ()))
+            for name_id in used:
+                if self.key_of(name_id) == key:
+                    self._remove(bucket, name_id)
+        return bucket
+
+    def remove(self, name_id):
+        bucket = self._buckets.get(self.key_of(name_id))
+        if bucket is not None:
+            self._remove(bucket, name_id)
+
+    def _remove(self, bucket, name_id):
+        index = self._moved.pop(name_id, None)
+        if index is None:
+            index = self.positions[name_id]
+        last = bucket.pop()
+        if index < len(bucket):
+            bucket[index] = last
+            self._moved[last] = index
+
+
+class CityPool:
+    """Несыгранные города одной игры.
+
+    Города хранятся как id из общего пула названий. Случайный бот берёт
+    города из корзин по первой букве, сложный — из корзин по паре букв,
+    выбирая последнюю букву, на которую у игрока осталось меньше всего
+    городов. Счётчики оставшихся городов по буквам обновляются при каждом
+    ходе, так что оба выбора стоят O(1) и O(число последних букв).
+    Выбор по населению тянет город из таблицы псевдонимов набора и
+    отбрасывает сыгранные; если отказов слишком много, таблица буквы
+    перестраивается для этой игры по несыгранным городам.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.used = set()  # id сыгранных городов
+        self._by_letter = _GameBuckets(dataset.buckets, dataset.positions, dataset.letter)
+        self._by_pair = _GameBuckets(dataset.pair_buckets, dataset.pair_positions, dataset.pair)
+        self._used_per_letter = defaultdict(int)
+        self._alias_tables = {}  # {буква: (id, prob, alias)} перестроенные для этой игры
+
+    def is_used(self, name_id):
+        return name_id in self.used
+
+    def use(self, name_id):
+        """Вычёркиваем город из несыгранных"""
+        self.used.add(name_id)
+        self._used_per_letter[self.dataset.letter(name_id)] += 1
+        self._by_letter.remove(name_id)
+        self._by_pair.remove(name_id)
+
+    def remaining(self, letter):
+        """Сколько несыгранных городов осталось на букву"""
+        return len(self.dataset.buckets.get(letter, ())) - self._used_per_letter[letter]
+
+    def random_city(self, letter):
+        """id случайного несыгранного города на букву или None"""
+        bucket = self._by_letter.get(letter, self.used)
+        return random.choice(bucket) if bucket else None
+
+    def famous_city(self, letter):
+        """id несыгранного города на букву с вероятностью по населению или None.
+
+        Если население известно у слишком малой доли городов на букву,
+        выбираем случайный город: иначе выпадали бы только города с данными.
+        """
+        if letter not in self.dataset.population_letters:
+            return self.random_city(letter)
+        if self.remaining(letter) <= 0:
+            return None
+        table = self._alias_tables.get(letter) or self.dataset.alias_tables[letter]
+        while True:
+            bucket, prob, alias = table
+            for _ in range(ALIAS_ATTEMPTS):
+                index = random.randrange(len(bucket))
+                name_id = bucket[index] if random.random() < prob[index] else bucket[alias[index]]
+                if name_id not in self.used:
+                    return name_id
+            # Сыграны почти все популярные города — перестраиваем таблицу по оставшимся
+            bucket = array("I", self._by_letter.get(letter, self.used))
+            table = self._alias_tables[letter] = (bucket, *build_alias_table([self.dataset.weight(i) for i in bucket]))
+
+    def hardest_city(self, letter):
+        """id города на букву, после которого у игрока меньше всего вариантов, или None"""
+        best_ends, best_count = [], None
+        for end_letter in self.dataset.end_letters.get(letter, ()):
+            if end_letter not in self.dataset.buckets:
+                continue  # На такую букву в наборе нет городов: игроку будет нечем ответить
+            if not self._by_pair.get((letter, end_letter), self.used):
+                continue
+            count = self.remaining(end_letter) - (end_letter == letter)  # Сам ход тоже убирает город
+            if best_count is None or count < best_count:
+                best_ends, best_count = [end_letter], count
+            elif count == best_count:
+                best_ends.append(end_letter)
+        if not best_ends:
+            return None
+        return random.choice(self._by_pair.get((letter, random.choice(best_ends)), self.used))
+
+
+_datasets = None
+
+
+def _make_datasets(payload):
+    names, population = payload["names"], payload["population"]
+    name_ids = {normalize_name(name): name_id for name_id, name in enumerate(names)}
+    return {
+        "world": CityDataset(names, name_ids, payload["world"], population),
+        "russia": CityDataset(names, name_ids, payload["russia"], population),
+    }
+
+
+def get_datasets():
+    """Лениво загружаем наборы городов {"world": CityDataset, "russia": CityDataset}"""
+    global _datasets
+    if _datasets is None:
+        _datasets = _make_datasets(load_index())
+    return _datasets
+
+
+def _source_mtimes():
+    return tuple(os.path.getmtime(source) for source in (WORLD_SOURCE, RUSSIA_SOURCE))
+
+
+def _rss_mb():
+    """Текущий RSS процесса в МБ (только Linux) или None"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _format_mb(value):
+    return "n/a" if value is None else f"{value:.1f} MB"
+
+
+async def watch_datasets(interval=RELOAD_CHECK_INTERVAL):
+    """Фоновая задача: при изменении JSON пересобираем наборы в потоке и подменяем их.
+
+    Идущие игры держат ссылку на свой CityDataset и доигрывают на старых
+    данных, новые игры получают новые наборы.
+    """
+    global _datasets
+    known_mtimes = _source_mtimes()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtimes = _source_mtimes()
+        except OSError as e:
+            logger.warning(f"Failed to check cities sources: {str(e)}")
+            continue
+        if mtimes == known_mtimes:
+            continue
+        known_mtimes = mtimes
+        if _datasets is None:
+            continue  # Ещё не загружены — get_datasets сам соберёт свежий индекс
+
+        logger.info("Cities sources changed, reloading")
+        started = time.perf_counter()
+        rss_before = _rss_mb()
+        try:
+            datasets = await asyncio.to_thread(lambda: _make_datasets(build_index()))
+        except Exception as e:
+            logger.error(f"Cities reload failed, keeping old data: {str(e)}")
+            continue
+        rss_peak = _rss_mb()  # Старые и новые наборы живут одновременно
+        _datasets = datasets  # Подмена одной ссылкой атомарна для event loop
+        logger.info(
+            f"Cities reloaded in {time.perf_counter() - started:.3f}s, "
+            f"RSS before {_format_mb(rss_before)}, during swap {_format_mb(rss_peak)}"
+        )
+
+
+def benchmark(moves=100_000):
+    """Замеряем выбор хода ботом на наборе городов мира"""
+    dataset = get_datasets()["world"]
+    letters = list(dataset.buckets)
+    for strategy in ("random_city", "famous_city", "hardest_city"):
+        pool, elapsed, made = CityPool(dataset), 0.0, 0
+        letter = random.choice(letters)
+        while made < moves:
+            started = time.perf_counter()
+            name_id = getattr(pool, strategy)(letter)
+            elapsed += time.perf_counter() - started
+            if name_id is None or len(pool.used) >= 1000:
+                pool, letter = CityPool(dataset), random.choice(letters)  # Новая партия
+                continue
+            pool.use(name_id)
+            made += 1
+            letter = dataset.end_letter(name_id)
+            if letter not in dataset.buckets:
+                letter = random.choice(letters)
+        print(f"{strategy}: {elapsed / moves * 1e6:.1f} µs per move ({moves} moves, world dataset)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--bench" in sys.argv:
+        benchmark()
+    else:
+        build_index()
@@ -0,0 +1,158 @@
+# clip_cache.py
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_DIR = BASE_DIR / "cache" / "clips"  # Отрезки треков (генерируется, в git не хранится)
+INDEX_NAME = "index.json"
+CLIP_SUFFIX = ".mp3"
+MAX_CACHE_BYTES = 200 * 1024 * 1024  # Сколько места на диске могут занимать отрезки
+
+
+def clip_key(track_id, offset):
+    """Ключ отрезка: какой трек и с какой секунды он вырезан"""
+    return f"{track_id}@{offset:.1f}"
+
+
+class ClipCache:
+    """Отрезки треков на диске с вытеснением давно не использованных (LRU).
+
+    Файл отрезка называется по хэшу ключа, поэтому один и тот же отрезок
+    хранится один раз. Вместе с файлом запоминается file_id, который
+    Telegram выдал при первой отправке: дальше отрезок отправляется по
+    file_id без повторной загрузки. Индекс хранится в index.json рядом с
+    отрезками и переживает перезапуск бота.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # {ключ: {file, size, source_size, file_id}} от старых к новым
+        self.total_bytes = 0
+        self.hits = 0             # Отрезок нашёлся: не качали и не резали трек
+        self.file_id_hits = 0     # Отрезок отправлен по file_id без загрузки в Telegram
+        self.misses = 0
+        self.download_bytes_saved = 0
+        self.upload_bytes_saved = 0
+        self._load()
+
+    def _index_path(self):
+        return self.directory / INDEX_NAME
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = []
+        for key, entry in entries:
+            if (self.directory / entry["file"]).exists():
+                self.entries[key] = entry
+                self.total_bytes += entry["size"]
+
+    def _save(self):
+        tmp_path = self._index_path().with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(list(self.entries.items()), file, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path())
+
+    def get(self, key):
+        """Путь к отрезку и его file_id (None, если ещё не отправляли) или None, если отрезка нет"""
+        entry = self.entries.get(key)
+        if entry is None or not (self.directory / entry["file"]).exists():
+            if entry is not None:
+                self._remove(key)
+                self._save()
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.download_bytes_saved += entry["source_size"]
+        return self.directory / entry["file"], entry["file_id"]
+
+    def peek(self, key):
+        """Как get(), но без учёта в статистике и без смены порядка вытеснения"""
+        entry = self.entries.get(key)
+        if entry is None or not (self.directory / entry["file"]).exists():
+            return None
+        return self.directory / entry["file"], entry["file_id"]
+
+    def put(self, key, data, source_size=0):
+        """Сохраняем байты отрезка в кэш; возвращаем путь к файлу"""
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest() + CLIP_SUFFIX
+        target = self.directory / name
+        tmp_path = target.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, target)
+        if key in self.entries:
+            self._remove(key, delete_file=False)
+        size = len(data)
+        self.entries[key] = {"file": name, "size": size, "source_size": source_size, "file_id": None}
+        self.total_bytes += size
+        self._evict(keep=key)
+        self._save()
+        return target
+
+    def set_file_id(self, key, file_id):
+        entry = self.entries.get(key)
+        if entry is not None and entry["file_id"] != file_id:
+            entry["file_id"] = file_id
+            self._save()
+
+    def used_file_id(self, key):
+        """Отрезок отправлен по file_id — загрузку в Telegram сэкономили"""
+        self.file_id_hits += 1
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.upload_bytes_saved += entry["size"]
+
+    def _remove(self, key, delete_file=True):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        if delete_file:
+            try:
+                os.remove(self.directory / entry["file"])
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            if key == keep:
+                break
+            logger.info(f"Evicting clip {key} from cache")
+            self._remove(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "clips": len(self.entries),
+            "bytes": self.total_bytes,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "file_id_hits": self.file_id_hits,
+            "download_bytes_saved": self.download_bytes_saved,
+            "upload_bytes_saved": self.upload_bytes_saved,
+        }
+
+
+_cache = None
+
+
+def get_clip_cache():
+    """Общий кэш отрезков; создаётся при первом обращении"""
+    global _cache
+    if _cache is None:
+        started = time.perf_counter()
+        _cache = ClipCache()
+        logger.info(f"Clip cache loaded: {len(_cache.entries)} clips, {_cache.total_bytes} bytes "
+                    f"in {time.perf_counter() - started:.3f}s")
+    return _cache
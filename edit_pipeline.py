@@ -0,0 +1,168 @@
+# edit_pipeline.py
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT = 50  # Сколько правок сообщений отправляется одновременно
+MAX_SLOWDOWN = 8.0  # Во сколько раз максимум замедляем игру после flood-wait
+SLOWDOWN_DECAY = 0.9  # После каждой удачной правки замедление уменьшается в столько раз
+MIN_EDIT_SPACING = 0.2  # Не правим одно сообщение чаще, чем раз в столько секунд
+NETWORK_BACKOFF = 1.0  # Пауза после первой сетевой ошибки (сек), дальше удваивается
+MAX_NETWORK_BACKOFF = 30.0
+MAX_NETWORK_ERRORS = 5  # Столько сетевых ошибок подряд — и игру пора завершать
+
+
+class _ChatState:
+    def __init__(self):
+        self.last_frame = None    # Последний кадр, который видит игрок
+        self.pending = None       # (кадр, send) — единственный ждущий отправки кадр
+        self.task = None
+        self.blocked_until = 0.0  # До какого момента Telegram просил не слать правки
+        self.last_sent = 0.0      # Когда ушла последняя правка
+        self.slowdown = 1.0
+        self.network_errors = 0   # Сетевых ошибок подряд
+        self.failed = None        # Ошибка, после которой сообщение править нельзя
+
+
+class EditPipeline:
+    """Отправка кадров игр реального времени с учётом ограничений Telegram.
+
+    На каждое игровое сообщение хранится не больше одного ждущего кадра:
+    новый кадр заменяет неотправленный, а кадр, совпадающий с уже
+    показанным, не отправляется. TelegramRetryAfter не завершает игру —
+    чат ставится на паузу на retry_after секунд, а интервал тиков
+    увеличивается (interval()), пока правки снова не пойдут без ошибок.
+    Правки одного сообщения идут не чаще min_spacing — кадры, пришедшие
+    между ними (например, после нажатия кнопки), склеиваются. Сетевые
+    ошибки и ошибки сервера Telegram ставят чат на паузу с удвоением
+    (после MAX_NETWORK_ERRORS подряд сообщение считается потерянным),
+    остальные ошибки API (бот заблокирован, сообщение удалено) сразу
+    отмечают сообщение как failed(), чтобы игра завершилась.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, min_spacing=MIN_EDIT_SPACING):
+        self.max_in_flight = max_in_flight
+        self.min_spacing = min_spacing
+        self._chats = {}
+        self._semaphore = None
+        self.produced = 0   # Кадров отдано играми
+        self.sent = 0       # Кадров отправлено в Telegram
+        self.coalesced = 0  # Кадров пропущено: устарели или не изменились
+        self.throttled = 0  # Ответов TelegramRetryAfter
+
+    def submit(self, key, frame, send):
+        """Ставим кадр в очередь сообщения; send — корутина-функция, которая правит сообщение"""
+        state = self._chats.setdefault(key, _ChatState())
+        self.produced += 1
+        if state.pending is not None:
+            self.coalesced += 1  # Предыдущий кадр так и не ушёл — заменяем его
+        elif frame == state.last_frame:
+            self.coalesced += 1
+            return
+        state.pending = (frame, send)
+        if state.task is None or state.task.done():
+            state.task = asyncio.create_task(self._drain(key, state))
+
+    def blocked(self, key):
+        """Сколько секунд сообщение ещё нельзя править (0, если можно)"""
+        state = self._chats.get(key)
+        return max(state.blocked_until - time.monotonic(), 0.0) if state else 0.0
+
+    def interval(self, key, base_interval):
+        """Интервал тика с учётом замедления после flood-wait"""
+        state = self._chats.get(key)
+        return base_interval * state.slowdown if state else base_interval
+
+    def failed(self, key):
+        """Ошибка Telegram, из-за которой игру пора завершить, или None"""
+        state = self._chats.get(key)
+        return state.failed if state else None
+
+    async def close(self, key):
+        """Отбрасываем неотправленные кадры сообщения перед финальной правкой"""
+        state = self._chats.pop(key, None)
+        if state is None or state.task is None or state.task.done():
+            return
+        state.pending = None
+        state.task.cancel()
+        try:
+            await state.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _drain(self, key, state):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        while state.pending is not None:
+            wait = max(state.blocked_until, state.last_sent + self.min_spacing) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            frame, send = state.pending
+            state.pending = None
+            if frame == state.last_frame:
+                self.coalesced += 1
+                continue
+            async with self._semaphore:
+                state.last_sent = time.monotonic()
+                try:
+                    await send()
+                except TelegramRetryAfter as e:
+                    self.throttled += 1
+                    state.blocked_until = time.monotonic() + e.retry_after
+                    state.slowdown = min(state.slowdown * 2, MAX_SLOWDOWN)
+                    logger.warning(f"Flood control for {key}: retry after {e.retry_after}s, slowdown x{state.slowdown}")
+                    if state.pending is None:
+                        state.pending = (frame, send)  # Отправим его, если новее не появится
+                    else:
+                        self.coalesced += 1
+                    continue
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    state.network_errors += 1
+                    if state.network_errors >= MAX_NETWORK_ERRORS:
+                        logger.warning(f"Giving up on message for {key} after {state.network_errors} errors: {str(e)}")
+                        state.failed = e
+                        state.pending = None
+                        return
+                    backoff = min(NETWORK_BACKOFF * 2 ** (state.network_errors - 1), MAX_NETWORK_BACKOFF)
+                    state.blocked_until = time.monotonic() + backoff
+                    logger.warning(f"Network error for {key}, retry in {backoff}s: {str(e)}")
+                    if state.pending is None:
+                        state.pending = (frame, send)
+                    else:
+                        self.coalesced += 1
+                    continue
+                except TelegramAPIError as e:
+                    if isinstance(e, TelegramBadRequest) and "message is not modified" in str(e):
+                        state.last_frame = frame
+                        continue
+                    logger.warning(f"Failed to update message for {key}: {str(e)}")
+                    state.failed = e
+                    state.pending = None
+                    return
+            state.last_frame = frame
+            state.network_errors = 0
+            state.slowdown = max(state.slowdown * SLOWDOWN_DECAY, 1.0)
+            self.sent += 1
+
+    def stats(self):
+        return {
+            "chats": len(self._chats),
+            "produced": self.produced,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "throttled": self.throttled,
+        }
+
+
+pipeline = EditPipeline()
@@ -0,0 +1,323 @@
+# game_sim.py
+import sys
+import time
+
+import numpy as np
+
+# Результат шага для каждой игры
+NONE, MOVED, ATE, DEAD, WON = -1, 0, 1, 2, 3
+
+# Направления змейки: (строка, столбец)
+UP, DOWN, LEFT, RIGHT = 0, 1, 2, 3
+DIRECTIONS = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int32)
+
+# Правила Динозаврика (значения по умолчанию — как в handlers/dino.py)
+DINO_WIDTH = 10
+DINO_INTERVAL = 0.5
+DINO_MIN_INTERVAL = 0.2
+ACCELERATION_RATE = 0.02
+ACCELERATION_INTERVAL = 5
+MIN_OBSTACLE_GAP = 3
+SPAWN_CHANCE = 0.2  # Шанс нового препятствия за тик
+CACTUS_CHANCE = 0.6  # Доля кактусов среди новых препятствий
+JUMP_TICKS = 2  # Сколько тиков динозавр в воздухе
+AIR, GROUND = 0, 1  # Дорожки: птицы летят на верхней строке, кактусы стоят на нижней
+MAX_DINO_WIDTH = 63  # Дорожка — биты uint64
+ONE = np.uint64(1)
+
+
+class SnakeBatch:
+    """n игр в Змейку на поле size×size, которые делают шаг одним вызовом.
+
+    Клетка — число row * size + col. body — кольцевой буфер клеток змейки
+    (голова в body[i, head[i]], дальше — назад по кольцу length[i] клеток),
+    occupied — занятые змейкой клетки, food — клетка с едой (-1, если поле
+    заполнено). Правила те же, что у snake_engine.Snake.
+    """
+
+    def __init__(self, n, size, seed=None):
+        self.n = n
+        self.size = size
+        self.cells = size * size
+        self.rng = np.random.default_rng(seed)
+        self.body = np.zeros((n, self.cells), dtype=np.int32)
+        self.head = np.zeros(n, dtype=np.int32)
+        self.length = np.ones(n, dtype=np.int32)
+        self.occupied = np.zeros((n, self.cells), dtype=bool)
+        self.food = np.full(n, -1, dtype=np.int32)
+        self.direction = np.full(n, RIGHT, dtype=np.int8)
+        self.alive = np.zeros(n, dtype=bool)
+        self.reset()
+
+    def reset(self, games=None):
+        """Начинаем заново игры с индексами games (по умолчанию — все)"""
+        games = np.arange(self.n) if games is None else np.asarray(games)
+        start = (self.size // 2) * self.size + self.size // 2
+        self.body[games, 0] = start
+        self.head[games] = 0
+        self.length[games] = 1
+        self.occupied[games] = False
+        self.occupied[games, start] = True
+        self.direction[games] = RIGHT
+        self.alive[games] = True
+        self._spawn_food(games)
+
+    def _spawn_food(self, games):
+        """Еда на случайной свободной клетке; возвращает маску игр, где места не осталось"""
+        keys = self.rng.random((len(games), self.cells))
+        keys[self.occupied[games]] = -1.0
+        cells = keys.argmax(axis=1)
+        full = keys[np.arange(len(games)), cells] < 0
+        self.food[games] = np.where(full, -1, cells)
+        return full
+
+    def turn(self, directions):
+        """Меняем направление: directions — массив на n игр, -1 оставляет прежнее"""
+        directions = np.asarray(directions)
+        change = directions >= 0
+        self.direction[change] = directions[change]
+
+    def step(self, directions=None):
+        """Шаг всех живых игр; возвращает массив MOVED/ATE/DEAD/WON (NONE для законченных)"""
+        if directions is not None:
+            self.turn(directions)
+        result = np.full(self.n, NONE, dtype=np.int8)
+        games = np.flatnonzero(self.alive)
+        if not len(games):
+            return result
+
+        head_cells = self.body[games, self.head[games]]
+        delta = DIRECTIONS[self.direction[games]]
+        rows = head_cells // self.size + delta[:, 0]
+        cols = head_cells % self.size + delta[:, 1]
+        inside = (rows >= 0) & (rows < self.size) & (cols >= 0) & (cols < self.size)
+        new_cells = np.where(inside, rows * self.size + cols, 0)
+        dead = ~inside | self.occupied[games, new_cells]
+
+        result[games[dead]] = DEAD
+        self.alive[games[dead]] = False
+        games, new_cells = games[~dead], new_cells[~dead]
+
+        self.head[games] = (self.head[games] + 1) % self.cells
+        self.body[games, self.head[games]] = new_cells
+        self.occupied[games, new_cells] = True
+
+        ate = new_cells == self.food[games]
+        moved = games[~ate]
+        tails = self.body[moved, (self.head[moved] - self.length[moved]) % self.cells]
+        self.occupied[moved, tails] = False
+        result[moved] = MOVED
+
+        grown = games[ate]
+        self.length[grown] += 1
+        full = self._spawn_food(grown)
+        result[grown] = np.where(full, WON, ATE)
+        self.alive[grown[full]] = False
+        return result
+
+    def cells_of(self, game):
+        """Клетки змейки от головы к хвосту (для отрисовки одной игры)"""
+        indexes = (self.head[game] - np.arange(self.length[game])) % self.cells
+        return self.body[game, indexes]
+
+
+class DinoBatch:
+    """n игр в Динозаврика, которые делают тик одним вызовом.
+
+    lanes[i, AIR] и lanes[i, GROUND] — дорожки в виде битовых масок: бит c
+    означает препятствие в столбце c (динозавр всегда в столбце 0). Мир
+    прокручивается сдвигом маски вправо, столкновение — бит 1 на дорожке
+    динозавра, проверка расстояния до нового препятствия — одна маска,
+    поэтому тик не зависит от ширины поля. jump_timer — сколько тиков
+    динозавр ещё в воздухе, pending — прыжок, нажатый в воздухе и ждущий
+    приземления. Параметры правил можно менять, чтобы подбирать их на
+    тысячах игр.
+    """
+
+    def __init__(self, n, width=DINO_WIDTH, seed=None, interval=DINO_INTERVAL, min_interval=DINO_MIN_INTERVAL,
+                 acceleration_rate=ACCELERATION_RATE, acceleration_interval=ACCELERATION_INTERVAL,
+                 min_obstacle_gap=MIN_OBSTACLE_GAP, spawn_chance=SPAWN_CHANCE, cactus_chance=CACTUS_CHANCE):
+        if not 1 < width <= MAX_DINO_WIDTH:
+            raise ValueError(f"width must be between 2 and {MAX_DINO_WIDTH}")
+        self.n = n
+        self.width = width
+        self.rng = np.random.default_rng(seed)
+        self.spawn_bit = ONE << np.uint64(width - 1)
+        self.gap_mask = ((ONE << np.uint64(min_obstacle_gap)) - ONE) << np.uint64(width - min_obstacle_gap)
+        self.start_interval = interval
+        self.min_interval = min_interval
+        self.acceleration_rate = acceleration_rate
+        self.acceleration_interval = acceleration_interval
+        self.min_obstacle_gap = min_obstacle_gap
+        self.spawn_chance = spawn_chance
+        self.cactus_chance = cactus_chance
+        self.lanes = np.zeros((n, 2), dtype=np.uint64)
+        self.jump_timer = np.zeros(n, dtype=np.int8)
+        self.pending = np.zeros(n, dtype=bool)
+        self.score = np.zeros(n, dtype=np.int32)
+        self.interval = np.zeros(n, dtype=np.float64)
+        self.alive = np.zeros(n, dtype=bool)
+        self.reset()
+
+    def reset(self, games=None):
+        """Начинаем заново игры с индексами games (по умолчанию — все)"""
+        games = np.arange(self.n) if games is None else np.asarray(games)
+        self.lanes[games] = 0
+        self.lanes[games, GROUND] = self.spawn_bit  # Начальный кактус
+        self.jump_timer[games] = 0
+        self.pending[games] = False
+        self.score[games] = 0
+        self.interval[games] = self.start_interval
+        self.alive[games] = True
+
+    @property
+    def jumping(self):
+        return self.jump_timer > 0
+
+    def jump(self, games):
+        """Нажатие «Прыжок»: на земле прыгаем сразу, в воздухе — запоминаем прыжок"""
+        games = np.asarray(games)
+        in_air = self.jump_timer[games] > 0
+        self.jump_timer[games[~in_air]] = JUMP_TICKS
+        self.pending[games[in_air]] = True
+
+    def step(self, jumps=None):
+        """Тик всех живых игр; jumps — маска нажатий «Прыжок». Возвращает MOVED/DEAD (NONE для законченных)"""
+        if jumps is not None:
+            self.jump(np.flatnonzero(np.asarray(jumps) & self.alive))
+        result = np.full(self.n, NONE, dtype=np.int8)
+        games = np.flatnonzero(self.alive)
+        if not len(games):
+            return result
+
+        # Приземление и отложенный прыжок
+        timer = self.jump_timer[games]
+        timer[timer > 0] -= 1
+        start = self.pending[games] & (timer == 0)
+        timer[start] = JUMP_TICKS
+        self.jump_timer[games] = timer
+        self.pending[games[start]] = False
+
+        # Столкновение: препятствие из столбца 1 входит в столбец 0 на дорожке динозавра
+        lane = np.where(timer > 0, AIR, GROUND)
+        dead = (self.lanes[games, lane] >> ONE & ONE).astype(bool)
+        result[games[dead]] = DEAD
+        self.alive[games[dead]] = False
+        games = games[~dead]
+
+        # Сдвигаем препятствия влево: столбец 0 уходит за край
+        lanes = self.lanes[games] >> ONE
+
+        # Новое препятствие не ближе min_obstacle_gap к предыдущему
+        spawn = self.rng.random(len(games)) < self.spawn_chance
+        spawn &= ((lanes[:, AIR] | lanes[:, GROUND]) & self.gap_mask) == 0
+        spawn_lane = np.where(self.rng.random(len(games)) < self.cactus_chance, GROUND, AIR)
+        lanes[spawn, spawn_lane[spawn]] |= self.spawn_bit
+        self.lanes[games] = lanes
+
+        score = self.score[games] + 1
+        self.score[games] = score
+        speed_up = score % self.acceleration_interval == 0
+        self.interval[games[speed_up]] = np.maximum(self.interval[games[speed_up]] - self.acceleration_rate,
+                                                    self.min_interval)
+        result[games] = MOVED
+        return result
+
+
+def scripted_jumps(dino):
+    """Простой бот: прыгает с земли, когда кактус в соседней клетке, а над ним нет птицы"""
+    next_column = dino.lanes >> ONE & ONE
+    return (next_column[:, GROUND] == 1) & (next_column[:, AIR] == 0) & ~dino.jumping
+
+
+def scripted_turns(snakes):
+    """Простой бот: идёт в свободную клетку, ближайшую к еде; в стену и в себя не сворачивает, пока есть выбор"""
+    head_cells = snakes.body[np.arange(snakes.n), snakes.head]
+    rows = head_cells[:, None] // snakes.size + DIRECTIONS[:, 0]
+    cols = head_cells[:, None] % snakes.size + DIRECTIONS[:, 1]
+    inside = (rows >= 0) & (rows < snakes.size) & (cols >= 0) & (cols < snakes.size)
+    cells = np.where(inside, rows * snakes.size + cols, 0)
+    free = inside & ~np.take_along_axis(snakes.occupied, cells, axis=1)
+    distance = np.abs(rows - snakes.food[:, None] // snakes.size) + np.abs(cols - snakes.food[:, None] % snakes.size)
+    # Свободная клетка всегда лучше занятой, среди свободных — ближе к еде
+    return np.argmax(np.where(free, 4 * snakes.size - distance, -distance), axis=1)
+
+
+def check_snake(n=1_000, ticks=300, size=6, seed=3):
+    """Сверяем SnakeBatch с snake_engine.Snake, на котором работает бот; возвращаем число расхождений.
+
+    Обе реализации получают одни и те же повороты и должны давать те же
+    результаты шага и то же тело змейки. Еду SnakeBatch ставит своим
+    генератором, поэтому её клетка после каждого шага переносится в Snake.
+    """
+    from snake_engine import Snake
+
+    codes = {Snake.MOVED: MOVED, Snake.ATE: ATE, Snake.DEAD: DEAD, Snake.WON: WON}
+    batch = SnakeBatch(n, size, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    snakes = [Snake(size) for _ in range(n)]
+
+    def sync_food(game):
+        food = int(batch.food[game])
+        snakes[game].food = divmod(food, size) if food >= 0 else None
+
+    for game in range(n):
+        sync_food(game)
+    mismatches = 0
+    for tick in range(ticks):
+        batch.turn(np.where(rng.random(n) < 0.3, rng.integers(0, 4, n), -1))
+        moves = [tuple(int(delta) for delta in DIRECTIONS[direction]) for direction in batch.direction]
+        result = batch.step()
+        finished = []
+        for game in np.flatnonzero(result != NONE):
+            expected = codes[snakes[game].step(moves[game])]
+            body = [divmod(int(cell), size) for cell in batch.cells_of(game)]
+            if expected != result[game] or (expected != DEAD and body != list(snakes[game].body)):
+                mismatches += 1
+                if mismatches == 1:
+                    print(f"tick {tick}, game {game}: Snake {expected} {list(snakes[game].body)}, "
+                          f"SnakeBatch {result[game]} {body}")
+            if expected in (DEAD, WON) or result[game] in (DEAD, WON):
+                finished.append(game)
+            else:
+                sync_food(game)
+        batch.reset(np.array(finished, dtype=np.int64))
+        for game in finished:
+            snakes[game] = Snake(size)
+            sync_food(game)
+    print(f"snake: {n} games x {ticks} ticks, {mismatches} mismatches between SnakeBatch and snake_engine.Snake")
+    return mismatches
+
+
+def benchmark(n=10_000, ticks=200):
+    """Шагов в секунду для n игр каждого вида"""
+    snakes = SnakeBatch(n, 10, seed=1)
+    started = time.perf_counter()
+    deaths = 0
+    for _ in range(ticks):
+        result = snakes.step(scripted_turns(snakes))
+        finished = np.flatnonzero((result == DEAD) | (result == WON))
+        deaths += np.count_nonzero(result == DEAD)
+        snakes.reset(finished)
+    elapsed = time.perf_counter() - started
+    print(f"snake: {n * ticks / elapsed:,.0f} game steps/s, average length {snakes.length.mean():.1f}, "
+          f"scripted bot died {deaths} times")
+
+    for width in (DINO_WIDTH, 30, MAX_DINO_WIDTH):
+        dinos = DinoBatch(n, width=width, seed=1)
+        started = time.perf_counter()
+        deaths = 0
+        for _ in range(ticks):
+            result = dinos.step(scripted_jumps(dinos))
+            dead = np.flatnonzero(result == DEAD)
+            deaths += len(dead)
+            dinos.reset(dead)
+        elapsed = time.perf_counter() - started
+        print(f"dino, width {width}: {n * ticks / elapsed:,.0f} game steps/s, scripted bot died {deaths} times")
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark()
+
+if __name__ == "__main__" and "--check" in sys.argv:
+    sys.exit(1 if check_snake() else 0)
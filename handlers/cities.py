@@ -1,50 +1,78 @@
-import json
-import random
+import asyncio
 from aiogram import Router
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-from keyboards import main_keyboard, finish_keyboard, give_up_keyboard, start_cities_keyboard
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from keyboards import main_keyboard, finish_keyboard, give_up_keyboard, start_cities_keyboard, cities_difficulty_keyboard, cities_basic_difficulty_keyboard
+from cities_data import CityPool, get_datasets, name_letter, name_end_letter, watch_datasets
+from sessions import Session
 
 router = Router()
 
-# 📌 Загружаем данные из JSON
-with open("data/cities.json", "r", encoding="utf-8") as file:
-    data = json.load(file)
-    WORLD_CITIES = {}
-    for item in data["city"]:
-        city_name = item["name"].strip()
-        first_letter = city_name[0].upper()
-        if first_letter not in WORLD_CITIES:
-            WORLD_CITIES[first_letter] = []
-        WORLD_CITIES[first_letter].append(city_name)
-
-with open("data/russia-cities.json", "r", encoding="utf-8") as file:
-    russia_data = json.load(file)
-    RUSSIA_CITIES = {}
-    for item in russia_data:
-        city_name = item["name"].strip()
-        first_letter = city_name[0].upper()
-        if first_letter not in RUSSIA_CITIES:
-            RUSSIA_CITIES[first_letter] = []
-        RUSSIA_CITIES[first_letter].append(city_name)
-
-# 📌 Активные игры {user_id: {last_letter, used_cities, cities_source, bot_limit, bot_moves}}
+# 📌 Режимы бота: метод CityPool, которым он выбирает город
+CITIES_MODES = {"🎲 Обычный": "random_city", "⭐ Известные города": "famous_city", "🧠 Сложный": "hardest_city"}
+
+# 📌 Активные игры {user_id: CitiesSession}
 active_games = {}
 
+class CitiesSession(Session):
+    """Игра в Города: буква для следующего хода, несыгранные города, режим и лимит бота"""
+
+    __slots__ = ("last_letter", "pool", "mode", "bot_limit", "bot_moves")
+    kind = "cities"
+
+    def __init__(self, user_id, pool):
+        super().__init__(user_id)
+        self.last_letter = None
+        self.pool = pool
+        self.mode = None
+        self.bot_limit = None
+        self.bot_moves = 0
+
+_watcher_task = None  # Держим ссылку, чтобы задачу не собрал сборщик мусора
+
+@router.startup()
+async def start_datasets_watcher():
+    """Запускаем фоновую перезагрузку наборов городов при изменении JSON"""
+    global _watcher_task
+    _watcher_task = asyncio.create_task(watch_datasets())
+
+def suggestions_keyboard(dataset, city_ids):
+    """Кнопки с подсказками «может, ты имел в виду»"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=dataset.name(city_id), callback_data=f"city_{city_id}")]
+        for city_id in city_ids
+    ])
+
 @router.message(lambda message: message.text == "🏙 Города")
 async def ask_cities_source(message: Message):
     """Спрашиваем, какие города использовать (Россия или мир)"""
+    get_datasets()  # Индекс городов загружается при первом входе в игру
     await message.answer("Выбери, какие города будем использовать:", reply_markup=start_cities_keyboard)
 
 @router.message(lambda message: message.text in ["🌍 Города мира", "🇷🇺 Города России"])
 async def ask_bot_limit(message: Message):
     """Спрашиваем лимит ответов бота"""
     user_id = message.from_user.id
-    cities_source = WORLD_CITIES if message.text == "🌍 Города мира" else RUSSIA_CITIES
-
-    active_games[user_id] = {"last_letter": None, "used_cities": set(), "cities_source": cities_source, "bot_moves": 0}
+    dataset = get_datasets()["world" if message.text == "🌍 Города мира" else "russia"]
+
+    active_games[user_id] = CitiesSession(user_id, CityPool(dataset))
+    await message.answer("Выбери сложность:", reply_markup=difficulty_keyboard(dataset))
+
+def difficulty_keyboard(dataset):
+    """«Известные города» предлагаем, только если у набора есть данные о населении"""
+    return cities_difficulty_keyboard if dataset.population_letters else cities_basic_difficulty_keyboard
+
+@router.message(lambda message: message.from_user.id in active_games and active_games[message.from_user.id].mode is None)
+async def set_difficulty(message: Message):
+    """Устанавливаем сложность: случайные ответы, известные города или стратегия"""
+    game = active_games[message.from_user.id]
+    mode = CITIES_MODES.get(message.text)
+    if mode is None or mode == "famous_city" and not game.pool.dataset.population_letters:
+        await message.answer("❌ Выбери сложность кнопкой.", reply_markup=difficulty_keyboard(game.pool.dataset))
+        return
+    game.mode = mode
     await message.answer("Сколько раз бот может отвечать? (Напиши число, например 10)")
 
-@router.message(lambda message: message.from_user.id in active_games and active_games[message.from_user.id].get("bot_limit") is None)
+@router.message(lambda message: message.from_user.id in active_games and active_games[message.from_user.id].bot_limit is None)
 async def set_bot_limit(message: Message):
     """Устанавливаем лимит ходов бота"""
     user_id = message.from_user.id
@@ -52,7 +80,7 @@ async def set_bot_limit(message: Message):
         bot_limit = int(message.text)
         if bot_limit < 3 or bot_limit > 50:
             raise ValueError
-        active_games[user_id]["bot_limit"] = bot_limit
+        active_games[user_id].bot_limit = bot_limit
         await message.answer("🏙️ Играем в 'Города'! Напиши первый город.", reply_markup=give_up_keyboard)
     except ValueError:
         await message.answer("❌ Введи число от 3 до 50.")
@@ -81,81 +109,88 @@ async def back_to_menu(message: Message):
         del active_games[user_id]
     await message.answer("🏠 Возвращаемся в меню...", reply_markup=main_keyboard)
 
+@router.callback_query(lambda c: c.data.startswith("city_") and c.from_user.id in active_games
+                       and active_games[c.from_user.id].bot_limit is not None)
+async def pick_suggested_city(callback: CallbackQuery):
+    """Игрок выбрал город из подсказки"""
+    user_id = callback.from_user.id
+    dataset = active_games[user_id].pool.dataset
+    city_id = int(callback.data.split("_")[1])
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer()
+    await play_city(callback.message, user_id, dataset.name(city_id))
+
 @router.message(lambda message: message.from_user.id in active_games)
 async def process_city(message: Message):
     """Обрабатываем ввод игрока"""
-    user_id = message.from_user.id
+    await play_city(message, message.from_user.id, message.text.strip())  # Оставляем исходный ввод игрока как есть
+
+async def play_city(message: Message, user_id: int, city_input: str):
+    """Проверяем город игрока и отвечаем ходом бота"""
     game = active_games[user_id]
-    city_input = message.text.strip()  # Оставляем исходный ввод игрока как есть
 
-    # 🔍 Приводим к нижнему регистру для проверки без учёта регистра
-    city_lower = city_input.lower()
-    first_letter = city_lower[0].upper()
+    # 🔍 Сравниваем без учёта регистра, Ё/Е, дефисов и пробелов
+    first_letter = name_letter(city_input)
 
     # 🔍 Проверяем, начинается ли город с нужной буквы (если она задана)
-    last_letter = game["last_letter"]
+    last_letter = game.last_letter
     if last_letter and first_letter != last_letter:
         await message.answer(f"⛔ Город должен начинаться на букву **{last_letter}**. Попробуй другой!")
         return
 
-    # 🔍 Проверяем, был ли город уже использован (без учёта регистра)
-    if city_lower in (c.lower() for c in game["used_cities"]):
-        await message.answer("⛔ Этот город уже был! Попробуй другой.")
-        return
+    # 🔍 Ищем город в базе (без учёта регистра)
+    pool = game.pool
+    dataset = pool.dataset
+    city_id = dataset.find(city_input)
 
-    # 🔍 Проверяем, есть ли город в базе (без учёта регистра)
-    cities_source = game["cities_source"]
-    if first_letter not in cities_source:
-        await message.answer(f"🤔 Не знаю такого города ({city_input}). Проверь правильность написания.")
+    # 🔍 Проверяем, был ли город уже использован
+    if city_id is not None and pool.is_used(city_id):
+        await message.answer("⛔ Этот город уже был! Попробуй другой.")
         return
 
-    # Ищем точное совпадение без учёта регистра
-    matching_city = None
-    for city in cities_source[first_letter]:
-        if city.lower() == city_lower:
-            matching_city = city  # Сохраняем оригинальный регистр из базы
-            break
-
-    if not matching_city:
-        await message.answer(f"🤔 Не знаю такого города ({city_input}). Проверь правильность написания.")
+    if city_id is None:
+        # 💡 Предлагаем похожие несыгранные города на нужную букву
+        suggestions = dataset.suggest(city_input, letter=last_letter, exclude=pool.used)
+        if suggestions:
+            await message.answer(f"🤔 Не знаю такого города ({city_input}). Может, ты имел в виду:",
+                                 reply_markup=suggestions_keyboard(dataset, suggestions))
+        else:
+            await message.answer(f"🤔 Не знаю такого города ({city_input}). Проверь правильность написания.")
         return
 
-    # ✅ Добавляем город в использованные (в оригинальном регистре из базы)
-    game["used_cities"].add(matching_city)
+    # ✅ Вычёркиваем город из несыгранных
+    pool.use(city_id)
+    matching_city = dataset.name(city_id)  # Оригинальный регистр из базы
 
     # 🔍 Определяем последнюю букву (исключая 'ъ', 'ь', 'ы')
-    last_letter = matching_city[-1].upper()
-    while last_letter in "ЪЬЫ":
-        last_letter = matching_city[-2].upper()
+    last_letter = name_end_letter(matching_city)
 
-    game["last_letter"] = last_letter
+    game.last_letter = last_letter
 
     # 📌 Проверяем, не исчерпал ли бот свой лимит
-    if game["bot_moves"] >= game["bot_limit"]:
+    if game.bot_moves >= game.bot_limit:
         await message.answer("🤖 Больше не знаю городов! Ты победил! 🎉", reply_markup=finish_keyboard)
         del active_games[user_id]
         return
 
     # 🤖 Бот ищет город на последнюю букву
-    if last_letter in cities_source:
-        possible_cities = [c for c in cities_source[last_letter] if c.lower() not in (used.lower() for used in game["used_cities"])]
+    if last_letter in dataset.buckets:
+        # 🎲 Случайный город, ⭐ город покрупнее или 🧠 ход на самую редкую букву
+        bot_city_id = getattr(pool, game.mode)(last_letter)
 
         # 🛑 Если городов реально нет, бот позволяет взять любую букву
-        if not possible_cities:
+        if bot_city_id is None:
             await message.answer(f"🤖 Я не знаю городов на букву {last_letter}. Можешь взять любую букву!")
-            game["last_letter"] = None
+            game.last_letter = None
             return
 
         # 📍 Если города есть, бот отвечает
-        bot_city = random.choice(possible_cities)
-        game["used_cities"].add(bot_city)
-        game["last_letter"] = bot_city[-1].upper()
-        game["bot_moves"] += 1
-
-        while game["last_letter"] in "ЪЬЫ":
-            game["last_letter"] = bot_city[-2].upper()
+        pool.use(bot_city_id)
+        bot_city = dataset.name(bot_city_id)
+        game.last_letter = dataset.end_letter(bot_city_id)
+        game.bot_moves += 1
 
-        await message.answer(f"📍 {bot_city}! Теперь тебе на **{game['last_letter']}**")
+        await message.answer(f"📍 {bot_city}! Теперь тебе на **{game.last_letter}**")
     else:
         await message.answer(f"🤖 Не знаю городов на {last_letter}. Бери любую букву!")
-        game["last_letter"] = None
\ No newline at end of file
+        game.last_letter = None
\ No newline at end of file
@@ -1,8 +1,11 @@
 # handlers/dino.py
 from aiogram import Router, types
-import asyncio
-import random
 import logging
+from functools import lru_cache
+from game_sim import DinoBatch, DEAD
+from sessions import Session
+from tick_scheduler import scheduler
+from edit_pipeline import pipeline
 
 router = Router()
 
@@ -10,7 +13,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
-FIELD_WIDTH = 10
+FIELD_WIDTH = 10  # До 63 клеток: тик и кадр почти не зависят от ширины
 FIELD_HEIGHT = 3
 DINO = "🦖"
 CACTUS = "🌵"
@@ -23,22 +26,55 @@ ENABLE_ACCELERATION = True  # Включение/выключение ускор
 ACCELERATION_RATE = 0.02  # Уменьшение интервала за шаг (сек)
 ACCELERATION_INTERVAL = 5  # Ускорение каждые 5 очков (быстрее, чем 10)
 MIN_MOVE_INTERVAL = 0.2  # Минимальный интервал (сек)
-
-active_games = {}
-
-def init_game():
-    field = [[EMPTY for _ in range(FIELD_WIDTH)] for _ in range(FIELD_HEIGHT)]
-    field[FIELD_HEIGHT-1][0] = DINO  # Динозавр на нижней строке (2,0)
-    obstacles = [(FIELD_HEIGHT-1, FIELD_WIDTH-1, "cactus")]  # Начальный кактус
-    jumping = False
-    jump_timer = 0
-    pending_jump = False
-    score = 0
-    move_interval = MOVE_INTERVAL
-    return field, obstacles, jumping, jump_timer, pending_jump, score, move_interval
-
-def render_field(field, score):
-    return f"Счёт: {score}\n" + "\n".join("".join(row) for row in field) + "\n" + GROUND * FIELD_WIDTH
+ROW_CACHE_SIZE = 4096  # Сколько готовых строк дорожек держим в памяти
+
+active_games = {}  # {user_id: DinoSession}
+
+class DinoSession(Session):
+    """Игра в Динозаврика: правила — в game_sim.DinoBatch, здесь одна игра на сессию"""
+
+    __slots__ = ("engine",)
+    kind = "dino"
+
+    def __init__(self, user_id):
+        super().__init__(user_id)
+        self.engine = DinoBatch(
+            1,
+            width=FIELD_WIDTH,
+            interval=MOVE_INTERVAL,
+            min_interval=MIN_MOVE_INTERVAL,
+            acceleration_rate=ACCELERATION_RATE if ENABLE_ACCELERATION else 0.0,
+            acceleration_interval=ACCELERATION_INTERVAL,
+            min_obstacle_gap=MIN_OBSTACLE_GAP,
+        )
+
+@lru_cache(maxsize=ROW_CACHE_SIZE)
+def render_row(bits, sprite, dino):
+    """Строка дорожки по её битовой маске; dino — динозавр в столбце 0"""
+    cells = [sprite if bits >> col & 1 else EMPTY for col in range(FIELD_WIDTH)]
+    if dino:
+        cells[0] = DINO
+    return "".join(cells)
+
+MIDDLE_ROW = EMPTY * FIELD_WIDTH
+GROUND_ROW = GROUND * FIELD_WIDTH
+
+def render_field(engine):
+    air, ground = (int(bits) for bits in engine.lanes[0])
+    jumping = bool(engine.jumping[0])
+    return "\n".join((
+        f"Счёт: {engine.score[0]}",
+        render_row(air, BIRD, jumping),
+        MIDDLE_ROW,
+        render_row(ground, CACTUS, not jumping),
+        GROUND_ROW,
+    ))
+
+def submit_frame(bot, user_id, game):
+    """Отдаём текущий кадр в конвейер правок"""
+    text = render_field(game.engine)
+    message_id = game.message_id
+    pipeline.submit(game.key, text, lambda: bot.edit_message_text(chat_id=user_id, message_id=message_id, text=text, reply_markup=get_keyboard()))
 
 def get_keyboard():
     return types.InlineKeyboardMarkup(inline_keyboard=[
@@ -50,129 +86,64 @@ def get_keyboard():
 async def dino_start(message: types.Message):
     user_id = message.from_user.id
     if user_id in active_games:
-        active_games[user_id]["running"] = False
-        await asyncio.sleep(0.1)
+        old_game = active_games[user_id]
+        old_game.running = False
+        scheduler.remove(old_game.key)
+        await pipeline.close(old_game.key)
     
-    field, obstacles, jumping, jump_timer, pending_jump, score, move_interval = init_game()
-    msg = await message.answer(render_field(field, score), reply_markup=get_keyboard())
+    game = DinoSession(user_id)
+    msg = await message.answer(render_field(game.engine), reply_markup=get_keyboard())
     
-    active_games[user_id] = {
-        "field": field,
-        "obstacles": obstacles,
-        "jumping": jumping,
-        "jump_timer": jump_timer,
-        "pending_jump": pending_jump,
-        "score": score,
-        "move_interval": move_interval,
-        "message_id": msg.message_id,
-        "running": True
-    }
+    game.message_id = msg.message_id
+    active_games[user_id] = game
     
+    move_interval = float(game.engine.interval[0])
     logger.info(f"Started game for user {user_id} with move_interval={move_interval}")
-    asyncio.create_task(dino_loop(message.bot, user_id))
+    scheduler.add(game.key, lambda: dino_tick(message.bot, user_id), move_interval)
     await message.answer("Динозаврик запущен! Используй 'Прыжок' для управления.")
 
-async def dino_loop(bot, user_id):
-    logger.info(f"Entering Dino loop for user {user_id}")
+async def dino_tick(bot, user_id):
+    """Один шаг игры; возвращает интервал до следующего шага или None, если игра окончена"""
+    if user_id not in active_games or not active_games[user_id].running:
+        return None
     try:
-        while user_id in active_games and active_games[user_id]["running"]:
-            game = active_games[user_id]
-            field = game["field"]
-            obstacles = game["obstacles"]
-            jumping = game["jumping"]
-            jump_timer = game["jump_timer"]
-            pending_jump = game["pending_jump"]
-            score = game["score"]
-            move_interval = game["move_interval"]
-            message_id = game["message_id"]
-
-            # Обновляем прыжок
-            if jump_timer > 0:
-                jump_timer -= 1
-                if jump_timer == 0:
-                    field[0][0] = EMPTY
-                    field[2][0] = DINO
-                    jumping = False
-                    logger.info(f"Dino landed for user {user_id} at position (2,0)")
-                    if pending_jump:
-                        field[2][0] = EMPTY
-                        field[0][0] = DINO
-                        jumping = True
-                        jump_timer = 2
-                        pending_jump = False
-                        logger.info(f"Buffered jump executed for user {user_id}, moved to (0,0)")
-            elif pending_jump and not jumping:
-                field[2][0] = EMPTY
-                field[0][0] = DINO
-                jumping = True
-                jump_timer = 2
-                pending_jump = False
-                logger.info(f"Buffered jump executed for user {user_id}, moved to (0,0)")
-
-            game["jump_timer"] = jump_timer
-            game["jumping"] = jumping
-            game["pending_jump"] = pending_jump
-
-            # Двигаем препятствия
-            new_obstacles = []
-            for row, col, obst_type in obstacles:
-                field[row][col] = EMPTY
-                new_col = col - 1
-                if new_col >= 0:
-                    if field[row][new_col] == DINO:
-                        await bot.edit_message_text(chat_id=user_id, message_id=message_id, text=f"Игра окончена! Счёт: {score}")
-                        logger.info(f"Collision detected for user {user_id} at position ({row},{new_col}), Type: {obst_type}, Score: {score}")
-                        del active_games[user_id]
-                        return
-                    field[row][new_col] = CACTUS if obst_type == "cactus" else BIRD
-                    new_obstacles.append((row, new_col, obst_type))
-                else:
-                    logger.info(f"{obst_type.capitalize()} removed for user {user_id} at left edge")
-
-            obstacles = new_obstacles
-
-            # Добавляем новое препятствие с проверкой расстояния
-            if (random.random() < 0.2 and 
-                not any(o[1] >= FIELD_WIDTH - MIN_OBSTACLE_GAP for o in obstacles)):
-                if random.random() < 0.6:  # 60% шанс на кактус
-                    obstacles.append((FIELD_HEIGHT-1, FIELD_WIDTH-1, "cactus"))
-                    field[FIELD_HEIGHT-1][FIELD_WIDTH-1] = CACTUS
-                    logger.info(f"New cactus added for user {user_id} at position ({FIELD_HEIGHT-1},{FIELD_WIDTH-1})")
-                else:  # 40% шанс на птицу
-                    obstacles.append((0, FIELD_WIDTH-1, "bird"))
-                    field[0][FIELD_WIDTH-1] = BIRD
-                    logger.info(f"New bird added for user {user_id} at position (0,{FIELD_WIDTH-1})")
-
-            # Устанавливаем динозавра на правильную позицию, если он не прыгает
-            if not jumping and field[2][0] != DINO:
-                field[2][0] = DINO
-                logger.info(f"Dino repositioned for user {user_id} at (2,0)")
-
-            score += 1
-            if ENABLE_ACCELERATION and score % ACCELERATION_INTERVAL == 0:
-                new_interval = max(move_interval - ACCELERATION_RATE, MIN_MOVE_INTERVAL)
-                if new_interval != move_interval:
-                    move_interval = new_interval
-                    logger.info(f"Speed increased for user {user_id}, new move_interval={move_interval}")
-            game["move_interval"] = move_interval
-            game["field"] = field
-            game["obstacles"] = obstacles
-            game["score"] = score
-
-            await bot.edit_message_text(chat_id=user_id, message_id=message_id, text=render_field(field, score), reply_markup=get_keyboard())
-            await asyncio.sleep(move_interval)
-    except Exception as e:
-        logger.error(f"Dino loop crashed for user {user_id}: {str(e)}")
-    finally:
-        if user_id in active_games:
+        game = active_games[user_id]
+        engine = game.engine
+        message_id = game.message_id
+        key = game.key
+
+        # Сообщение больше нельзя править — завершаем игру; flood-wait — ставим на паузу
+        if pipeline.failed(key):
+            await pipeline.close(key)
             del active_games[user_id]
+            return None
+        blocked = pipeline.blocked(key)
+        if blocked:
+            return blocked
+
+        if engine.step()[0] == DEAD:
+            score = int(engine.score[0])
+            await pipeline.close(key)
+            await bot.edit_message_text(chat_id=user_id, message_id=message_id, text=f"Игра окончена! Счёт: {score}")
+            logger.info(f"Collision detected for user {user_id}, Score: {score}")
+            del active_games[user_id]
+            return None
+
+        submit_frame(bot, user_id, game)
+        return pipeline.interval(key, float(engine.interval[0]))
+    except Exception as e:
+        logger.error(f"Dino tick crashed for user {user_id}: {str(e)}")
+        active_games.pop(user_id, None)
+        return None
 
 @router.callback_query(lambda c: c.data == "stop" and c.from_user.id in active_games)
 async def dino_stop(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     game = active_games[user_id]
-    game["running"] = False
-    await callback.bot.edit_message_text(chat_id=user_id, message_id=game["message_id"], text=f"Игра окончена! Счёт: {game['score']}")
+    game.running = False
+    scheduler.remove(game.key)
+    await pipeline.close(game.key)
+    await callback.bot.edit_message_text(chat_id=user_id, message_id=game.message_id, text=f"Игра окончена! Счёт: {game.engine.score[0]}")
     await callback.answer()
     logger.info(f"Game stopped by user {user_id}")
     del active_games[user_id]
@@ -181,14 +152,11 @@ async def dino_stop(callback: types.CallbackQuery):
 async def dino_jump(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     game = active_games[user_id]
-    logger.info(f"Jump requested by user {user_id}, jumping={game['jumping']}, timer={game['jump_timer']}, pending={game['pending_jump']}, dino_pos={game['field'][2][0]}")
-    if not game["jumping"] and game["field"][2][0] == DINO:
-        game["field"][2][0] = EMPTY
-        game["field"][0][0] = DINO
-        game["jumping"] = True
-        game["jump_timer"] = 2
-        logger.info(f"Jump executed for user {user_id}, moved to (0,0)")
-    else:
-        game["pending_jump"] = True
-        logger.info(f"Jump buffered for user {user_id}")
-    await callback.answer()
\ No newline at end of file
+    engine = game.engine
+    logger.info(f"Jump requested by user {user_id}, jump_timer={engine.jump_timer[0]}, pending={engine.pending[0]}")
+    was_jumping = bool(engine.jumping[0])
+    engine.jump([0])
+    if not was_jumping:
+        # Динозавр взлетел — показываем это сразу, не дожидаясь тика (не чаще MIN_EDIT_SPACING)
+        submit_frame(callback.bot, user_id, game)
+    await callback.answer()
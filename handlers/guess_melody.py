@@ -2,16 +2,18 @@
 from aiogram import Router, types
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from yandex_music import Client
+from aiogram.exceptions import TelegramBadRequest
 from config import YANDEX_TOKEN
 import random
 import logging
 import aiohttp
 import os
 import asyncio
-import ffmpeg
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile, FSInputFile
 from pathlib import Path
+from clip_cache import clip_key, get_clip_cache
+from transcoder import TranscoderBusy, cut_clips, transcoder
+from yandex_client import YandexMusic
 
 router = Router()
 
@@ -31,7 +33,8 @@ if not os.path.exists(FFMPEG_PATH):
 os.environ["PATH"] = str(FFMPEG_BIN_DIR) + os.pathsep + os.environ["PATH"]
 
 
-client = Client(YANDEX_TOKEN).init()
+# Клиент Яндекс Музыки подключается при первом запросе, а запросы идут в отдельных потоках
+yandex = YandexMusic(YANDEX_TOKEN)
 
 class GuessMelody(StatesGroup):
     playing = State()
@@ -50,126 +53,271 @@ TRACKS = [
 ]
 
 TRACK_DURATION = 10  # 10 секунд
-
-async def download_and_cut_track(preview_url):
+CLIP_OFFSETS = 3  # Сколько разных отрезков режем из одного трека (одинаковые отрезки берём из кэша)
+SEEK_MARGIN = 2  # Сколько секунд трека берём с запаса по краям отрезка (битрейт бывает неточным)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 30  # Сколько секунд ждём окно трека (до очереди ffmpeg)
+BATCH_WINDOW = 30  # Отрезки трека, которые вместе влезают в столько секунд, режем одним запуском ffmpeg
+# Кодек из Яндекс Музыки -> формат входа ffmpeg (неизвестный кодек ffmpeg определит сам)
+INPUT_FORMATS = {"mp3": "mp3", "aac": "aac", "he-aac": "aac"}
+PREFETCH_DEPTH = 2  # Сколько следующих раундов готовим, пока игрок отвечает
+PREFETCH_TTL = 600  # Через сколько секунд выбрасываем неиспользованный раунд (игру бросили)
+
+# {user_id: {номер раунда: asyncio.Task}} — раунды, которые готовятся заранее
+prefetched_rounds = {}
+
+def clip_offsets(duration_ms):
+    """Все CLIP_OFFSETS точек трека, с которых режем отрезки (одинаковые отрезки попадают в кэш)"""
+    span = (duration_ms or 0) / 1000 - TRACK_DURATION
+    if span <= 0:
+        return [0.0]
+    # Точки внутри трека: без вступления и затухания в самом конце
+    return [round((i + 1) * span / (CLIP_OFFSETS + 1), 1) for i in range(CLIP_OFFSETS)]
+
+def seek_window(first_offset, last_offset, bytes_per_second):
+    """Байты трека, которые нужны для отрезков с first_offset по last_offset, с запасом SEEK_MARGIN секунд"""
+    lead = min(first_offset, SEEK_MARGIN)
+    first_byte = int((first_offset - lead) * bytes_per_second)
+    last_byte = int((last_offset + TRACK_DURATION + SEEK_MARGIN) * bytes_per_second)
+    return first_byte, last_byte, lead
+
+async def download_window(url, first_offset=None, last_offset=None, duration_ms=None, bitrate_kbps=None):
+    """Скачиваем в память только байты трека, которые покрывают отрезки с first_offset по last_offset.
+
+    Окно байтов считаем по битрейту (или по Content-Length и длительности);
+    без first_offset качаем файл целиком (короткое превью). Качаем до
+    постановки в очередь ffmpeg, чтобы сеть не занимала его слоты.
+    Возвращаем (байты окна, с какой секунды трека оно начинается, сколько байт скачали) или None.
+    """
+    bytes_per_second = bitrate_kbps * 125 if bitrate_kbps else None
+    headers = {}
+    first_byte, last_byte, lead = 0, None, 0.0
+    if first_offset is not None and bytes_per_second:
+        first_byte, last_byte, lead = seek_window(first_offset, last_offset, bytes_per_second)
+        headers["Range"] = f"bytes={first_byte}-{last_byte}"
     try:
-        logger.info(f"Downloading track from {preview_url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(preview_url) as response:
-                if response.status != 200:
+        logger.info(f"Downloading track from {url}")
+        timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 416:
+                    logger.error(f"Track ends before byte {first_byte}: it is shorter than its duration_ms")
+                    return None
+                if response.status not in (200, 206):
                     logger.error(f"Failed to download track: HTTP {response.status}")
                     return None
-                with open("temp_track.mp3", "wb") as f:
-                    f.write(await response.read())
-        logger.info("Track downloaded")
-
-        if not os.path.exists("temp_track.mp3"):
-            logger.error("Temp track file was not created")
-            return None
-        file_size = os.path.getsize("temp_track.mp3")
-        if file_size == 0:
-            logger.error("Temp track file is empty")
-            return None
-
-        logger.info("Cutting track")
-        duration = float(ffmpeg.probe("temp_track.mp3")["format"]["duration"])
-        if duration > TRACK_DURATION:
-            start_point = random.uniform(0, duration - TRACK_DURATION)
-        else:
-            start_point = 0
-
-        command = [
-            FFMPEG_PATH,
-            '-i', 'temp_track.mp3',
-            '-ss', str(start_point),
-            '-t', str(TRACK_DURATION),
-            '-acodec', 'mp3',
-            '-y',
-            'cut_track.mp3'
-        ]
-
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
 
-        try:
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=60)
-            if process.returncode != 0:
-                logger.error(f"FFmpeg failed: {stderr.decode().strip()}")
-                return None
-            # Логируем только ключевой результат
-            stderr_str = stderr.decode().strip()
-            if stderr_str:
-                for line in stderr_str.splitlines():
-                    if "size=" in line or "time=" in line or "bitrate=" in line:
-                        logger.info(f"FFmpeg result: {line.strip()}")
-            logger.info("Track cut completed")
-        except asyncio.TimeoutError:
-            logger.error("FFmpeg timed out")
-            process.kill()
-            await process.communicate()
-            return None
-
-        os.remove("temp_track.mp3")
-        if not os.path.exists("cut_track.mp3"):
-            logger.error("Cut track file was not created")
-            return None
-        return "cut_track.mp3"
+                if first_offset is not None and not bytes_per_second:
+                    if not response.content_length or not duration_ms:
+                        logger.error("Neither bitrate nor Content-Length and duration are known")
+                        return None
+                    bytes_per_second = response.content_length / (duration_ms / 1000)
+                    first_byte, last_byte, lead = seek_window(first_offset, last_offset, bytes_per_second)
+                # Сервер не поддержал Range — пропускаем начало трека сами
+                skip = first_byte if response.status == 200 else 0
+                size = last_byte - first_byte + 1 if last_byte is not None else None
+                downloaded = 0
+                window = bytearray()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    downloaded += len(chunk)
+                    if skip:
+                        dropped = min(skip, len(chunk))
+                        chunk, skip = chunk[dropped:], skip - dropped
+                    if size is None:
+                        window += chunk
+                        continue
+                    window += chunk[:size - len(window)]
+                    if len(window) >= size:
+                        break
     except Exception as e:
-        logger.error(f"Error cutting track: {str(e)}")
+        logger.error(f"Error downloading track: {str(e)}")
+        return None
+    if not window:
+        logger.error("Downloaded track window is empty")
         return None
+    return bytes(window), (first_offset or 0.0) - lead, downloaded
 
-async def get_track_options(state: FSMContext):
-    data = await state.get_data()
-    track_list = data.get("track_list")
-    current_round = data.get("round", 1)
+async def cut_window(window, window_start, offsets, input_format):
+    """Задание для transcoder: режем из окна трека отрезки с offsets одним запуском ffmpeg"""
+    segments = [(round(offset - window_start, 3), TRACK_DURATION) for offset in offsets]
+    try:
+        clips = await cut_clips(FFMPEG_PATH, window, segments, input_format)
+    except Exception as e:
+        logger.error(f"Error cutting track: {str(e)}")
+        return None
+    if not all(clips):
+        logger.error("Cut track is empty")
+        return None
+    return clips
 
-    if not track_list:  # Если список песен ещё не создан
-        track_list = TRACKS.copy()
-        random.shuffle(track_list)
-        await state.update_data(track_list=track_list)
+async def get_track_options(track_query, background=False):
+    """Готовим раунд: ищем трек, нарезаем отрывок и собираем варианты ответа.
 
-    track_query = track_list[current_round - 1]
-    
+    Если отрезка нет в кэше, тем же запуском ffmpeg режем ещё не нарезанные
+    отрезки трека из того же окна (BATCH_WINDOW). Если Яндекс отдаёт только
+    превью, отрезок берём из него, а точки считаем по длине самого превью.
+    background — заготовка раунда: ей достаётся только фоновая часть
+    очереди ffmpeg. TranscoderBusy пробрасывается наверх.
+    """
     try:
         logger.info(f"Searching for track: {track_query}")
-        search_result = client.search(track_query, type_="track")
-        if not search_result.tracks or not search_result.tracks.results:
-            logger.warning(f"No results found for track: {track_query}")
-            return None, None, None
-        
-        track = search_result.tracks.results[0]
-        download_info = track.get_download_info()
-        if not download_info:
-            logger.warning(f"No download info available for track: {track_query}")
-            return None, None, None
+        track = await yandex.search_track(track_query)
+        if track is None:
+            return None, None, None, None
         
-        preview_url = download_info[0].get_direct_link()
-        if not preview_url:
-            logger.warning(f"No direct link available for track: {track_query}")
-            return None, None, None
-        
-        cut_file = await download_and_cut_track(preview_url)
-        if not cut_file:
-            return None, None, None
+        offsets = clip_offsets(track.duration_ms)
+        offset = random.choice(offsets)
+        clip_id = track.id
+        key = clip_key(clip_id, offset)
+        clip_cache = get_clip_cache()
+        clip = None
+        if clip_cache.get(key) is None:
+            link = await yandex.download_link(track)
+            if link is None:
+                return None, None, None, None
+            
+            url, codec, bitrate_kbps, preview = link
+            if preview:
+                # Превью короче трека: качаем его целиком, точки считаем по его длине (Content-Length ÷ битрейт)
+                fetched = await download_window(url)
+                if not fetched:
+                    return None, None, None, None
+                window, window_start, downloaded = fetched
+                preview_ms = len(window) * 8 / bitrate_kbps if bitrate_kbps else None
+                logger.info(f"Only a preview is available for track {track.id}: {preview_ms} ms, {codec}")
+                offset = random.choice(clip_offsets(preview_ms))
+                clip_id = f"{track.id}-preview"
+                key = clip_key(clip_id, offset)
+                batch = [offset]
+            else:
+                # Заодно режем ещё не нарезанные отрезки трека, если они влезают в одно небольшое окно
+                batch = [other for other in offsets
+                         if other == offset or abs(other - offset) <= (BATCH_WINDOW - TRACK_DURATION) / 2
+                         and clip_cache.peek(clip_key(clip_id, other)) is None]
+                fetched = await download_window(url, min(batch), max(batch), track.duration_ms, bitrate_kbps)
+                if not fetched:
+                    return None, None, None, None
+                window, window_start, downloaded = fetched
+
+            if clip_cache.peek(key) is None:
+                input_format = INPUT_FORMATS.get(codec)
+                clips = await transcoder.submit(lambda: cut_window(window, window_start, batch, input_format),
+                                                background=background)
+                if not clips:
+                    return None, None, None, None
+                logger.info(f"Track cut completed: {downloaded} bytes downloaded, {len(clips)} clips")
+                for batch_offset, batch_clip in zip(batch, clips):
+                    clip_cache.put(clip_key(clip_id, batch_offset), batch_clip, source_size=downloaded // len(clips))
+                clip = clips[batch.index(offset)]
+            else:
+                logger.info(f"Clip {key} found in cache")
+        else:
+            logger.info(f"Clip {key} found in cache")
         
         correct_answer = f"{track.artists[0].name} - {track.title}"
         wrong_options = random.sample([t for t in TRACKS if t != track_query], 3)
         options = [correct_answer] + wrong_options
         random.shuffle(options)
         logger.info(f"Selected track: {correct_answer}")
-        return cut_file, correct_answer, options
+        return key, clip, correct_answer, options
+    except TranscoderBusy:
+        raise
     except Exception as e:
         logger.error(f"Error fetching track {track_query}: {str(e)}")
-        return None, None, None
+        return None, None, None, None
+
+def _drop_round(task):
+    if task.done() and not task.cancelled():
+        task.exception()  # Например, TranscoderBusy: читаем, чтобы asyncio не ругался на непрочитанную ошибку
+    task.cancel()  # Отрезок, если он успел нарезаться, остаётся в кэше
+
+def _expire_round(user_id, round_number, task):
+    rounds = prefetched_rounds.get(user_id)
+    if rounds and rounds.get(round_number) is task:
+        del rounds[round_number]
+        if not rounds:
+            del prefetched_rounds[user_id]
+        _drop_round(task)
+        logger.info(f"Prefetched round {round_number} for user {user_id} expired")
+
+def prefetch_rounds(user_id, track_list, first_round, max_rounds):
+    """Начинаем готовить раунды first_round.. в фоне, пока игрок слушает текущий.
+
+    Если фоновая часть очереди ffmpeg занята, ничего не заготавливаем:
+    раунд приготовится, когда до него дойдёт очередь.
+    """
+    if not transcoder.has_room(background=True):
+        logger.info(f"Transcoder is busy, not prefetching rounds for user {user_id}")
+        return
+    rounds = prefetched_rounds.setdefault(user_id, {})
+    loop = asyncio.get_running_loop()
+    for round_number in range(first_round, min(first_round + PREFETCH_DEPTH, max_rounds + 1)):
+        if round_number in rounds:
+            continue
+        task = asyncio.create_task(get_track_options(track_list[round_number - 1], background=True))
+        rounds[round_number] = task
+        loop.call_later(PREFETCH_TTL, _expire_round, user_id, round_number, task)
+        logger.info(f"Prefetching round {round_number} for user {user_id}")
+
+async def take_round(user_id, track_list, round_number):
+    """Готовый (или готовящийся) раунд из заготовок; если его нет — готовим сейчас"""
+    rounds = prefetched_rounds.get(user_id, {})
+    task = rounds.pop(round_number, None)
+    if task is None:
+        return await get_track_options(track_list[round_number - 1])
+    logger.info(f"Using prefetched round {round_number} for user {user_id} (ready: {task.done()})")
+    try:
+        return await task
+    except TranscoderBusy:
+        # Заготовке не хватило места в очереди ffmpeg — пробуем ещё раз, уже для текущего раунда
+        return await get_track_options(track_list[round_number - 1])
+
+async def round_is_current(state: FSMContext, track_list, round_number):
+    """Игра всё ещё идёт и ждёт именно этот раунд (её не завершили и не начали заново)"""
+    if await state.get_state() != GuessMelody.playing:
+        return False
+    data = await state.get_data()
+    return data.get("track_list") == track_list and data.get("round") == round_number
+
+def cancel_prefetch(user_id):
+    """Отменяем заготовки раундов: игра закончилась или состояние сброшено"""
+    for task in prefetched_rounds.pop(user_id, {}).values():
+        _drop_round(task)
+
+async def send_clip(bot, user_id, key, clip, keyboard):
+    """Отправляем отрезок: по file_id, если Telegram его уже видел, иначе загружаем.
+
+    clip — байты только что нарезанного отрезка (None, если он взят из кэша).
+    """
+    clip_cache = get_clip_cache()
+    cached = clip_cache.peek(key)
+    if cached is None and clip is None:
+        raise FileNotFoundError(f"Clip {key} was evicted from cache")
+    path, file_id = cached or (None, None)
+    if file_id:
+        try:
+            await bot.send_voice(chat_id=user_id, voice=file_id, reply_markup=keyboard)
+            clip_cache.used_file_id(key)
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Cached file_id for clip {key} rejected, uploading again: {str(e)}")
+            clip_cache.set_file_id(key, None)
+    voice = BufferedInputFile(clip, filename="clip.mp3") if clip is not None else FSInputFile(path)
+    sent = await bot.send_voice(chat_id=user_id, voice=voice, reply_markup=keyboard)
+    clip_cache.set_file_id(key, sent.voice.file_id)
+
+async def finish_game(state: FSMContext, user_id: int):
+    cancel_prefetch(user_id)
+    await state.clear()
 
 @router.message(lambda message: message.text == "🎵 Угадай мелодию")
 async def start_guess_melody(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
+    cancel_prefetch(user_id)  # Заготовки прошлой игры, если её бросили
+    track_list = TRACKS.copy()
+    random.shuffle(track_list)
     await state.set_state(GuessMelody.playing)
-    await state.update_data(round=1, score=0, max_rounds=5, track_list=None)
+    await state.update_data(round=1, score=0, max_rounds=5, track_list=track_list)
     await next_round(message, state, user_id)
 
 async def next_round(message: types.Message, state: FSMContext, user_id: int):
@@ -177,7 +325,7 @@ async def next_round(message: types.Message, state: FSMContext, user_id: int):
     if not data:
         logger.error("State data is empty")
         await message.reply("Ошибка: данные состояния потеряны. Начни игру заново.")
-        await state.clear()
+        await finish_game(state, user_id)
         return
 
     current_round = data["round"]
@@ -186,19 +334,25 @@ async def next_round(message: types.Message, state: FSMContext, user_id: int):
 
     if current_round > max_rounds:
         await message.reply(f"Игра окончена! Твой счёт: {score}/{max_rounds}")
-        await state.clear()
+        await finish_game(state, user_id)
         return
 
-    cut_file, correct_answer, options = await get_track_options(state)
-    if not cut_file:
-        await message.reply("Не удалось найти песню, попробуй снова!")
-        await state.clear()
+    track_list = data["track_list"]
+    try:
+        prepared = await take_round(user_id, track_list, current_round)
+    except TranscoderBusy:
+        prepared = None
+    if not await round_is_current(state, track_list, current_round):
+        logger.info(f"Game of user {user_id} ended while round {current_round} was being prepared")
         return
-
-    if not os.path.exists(cut_file) or os.path.getsize(cut_file) == 0:
-        logger.error(f"File {cut_file} does not exist or is empty")
-        await message.reply("Ошибка: файл с аудио не найден или пуст.")
-        await state.clear()
+    if prepared is None:
+        await message.reply("Сейчас очень много игроков слушают мелодии 🎧 Попробуй через минуту!")
+        await finish_game(state, user_id)
+        return
+    key, clip, correct_answer, options = prepared
+    if not key:
+        await message.reply("Не удалось найти песню, попробуй снова!")
+        await finish_game(state, user_id)
         return
 
     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -210,21 +364,22 @@ async def next_round(message: types.Message, state: FSMContext, user_id: int):
 
     logger.info("Sending voice message")
     try:
-        await asyncio.wait_for(
-            message.bot.send_voice(chat_id=user_id, voice=FSInputFile(cut_file), reply_markup=keyboard),
-            timeout=30
-        )
-        logger.info("Voice sent")
-        os.remove(cut_file)
+        await asyncio.wait_for(send_clip(message.bot, user_id, key, clip, keyboard), timeout=30)
+        logger.info(f"Voice sent, clip cache: {get_clip_cache().stats()}, Yandex Music: {yandex.stats()}, "
+                    f"ffmpeg: {transcoder.stats()}")
+        if not await round_is_current(state, track_list, current_round):
+            return  # Игру завершили, пока отправлялся отрезок
         await state.update_data(correct_answer=correct_answer, options=options)
+        # Пока игрок слушает и отвечает, готовим следующие раунды
+        prefetch_rounds(user_id, track_list, current_round + 1, max_rounds)
     except asyncio.TimeoutError:
         logger.error("Timeout while sending voice message")
         await message.reply("Ошибка: время отправки аудио истекло.")
-        await state.clear()
+        await finish_game(state, user_id)
     except Exception as e:
         logger.error(f"Error sending voice: {str(e)}")
         await message.reply("Ошибка при отправке аудио, попробуй снова!")
-        await state.clear()
+        await finish_game(state, user_id)
 
 @router.callback_query(GuessMelody.playing, lambda c: c.data.startswith("answer_"))
 async def process_answer(callback: types.CallbackQuery, state: FSMContext):
@@ -255,5 +410,5 @@ async def end_game(callback: types.CallbackQuery, state: FSMContext):
     score = data["score"]
     max_rounds = data["max_rounds"]
     await callback.message.reply(f"Игра завершена! Твой счёт: {score}/{max_rounds}")
-    await state.clear()
+    await finish_game(state, callback.from_user.id)
     await callback.answer()
\ No newline at end of file
@@ -1,44 +1,66 @@
 # handlers/snake_v2.py
 from aiogram import Router
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from aiogram.exceptions import TelegramBadRequest
-import random
-import asyncio
 import logging
+from collections import deque
+from functools import lru_cache
+from snake_engine import Snake
+from sessions import Session
+from tick_scheduler import scheduler
+from edit_pipeline import pipeline
 
 router = Router()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-FIELD_SIZE = 10
+FIELD_SIZE = 10  # Можно увеличивать: ход змейки и выбор еды не зависят от размера поля
 SNAKE = '🟩'  # Зеленый квадрат для змейки
 FOOD = '🟥'   # Красный квадрат для еды
 EMPTY = '⬜'  # Белый квадрат для пустого пространства
 MOVE_INTERVAL = 0.8  # Оставляем ваш интервал
+MIN_TURN_SPACING = 0.3  # Нажатие двигает змейку сразу, но не чаще, чем раз в столько секунд
+INPUT_QUEUE_SIZE = 3  # Сколько нажатий помним, если игрок жмёт быстрее, чем змейка ходит
 
-active_games = {}
-
-def init_game():
-    field = [[EMPTY for _ in range(FIELD_SIZE)] for _ in range(FIELD_SIZE)]
-    snake = [(FIELD_SIZE//2, FIELD_SIZE//2)]
-    field[snake[0][0]][snake[0][1]] = SNAKE
-    direction = (0, 1)  # Начальное направление (вправо)
-    food = spawn_food(field, snake)
-    pending_direction = None  # Буфер для следующего направления
-    score = 0  # Начальный счёт
-    return field, snake, direction, food, pending_direction, score
-
-def spawn_food(field, snake):
-    while True:
-        x = random.randint(0, FIELD_SIZE-1)
-        y = random.randint(0, FIELD_SIZE-1)
-        if (x, y) not in snake:
-            field[x][y] = FOOD
-            return (x, y)
+SPRITES = (EMPTY, SNAKE, FOOD)  # Клетки поля: 0 - пусто, 1 - змейка, 2 - еда
+
+active_games = {}  # {user_id: SnakeSession}
+
+class SnakeSession(Session):
+    """Игра в Змейку: поле — bytearray FIELD_SIZE×FIELD_SIZE со значениями 0/1/2"""
+
+    __slots__ = ("field", "snake", "direction", "inputs", "score")
+    kind = "snake"
+
+    def __init__(self, user_id):
+        super().__init__(user_id)
+        self.field = bytearray(FIELD_SIZE * FIELD_SIZE)
+        self.snake = snake = Snake(FIELD_SIZE)
+        self.paint(snake.head, 1)
+        self.paint(snake.food, 2)
+        self.direction = (0, 1)  # Начальное направление (вправо)
+        self.inputs = deque(maxlen=INPUT_QUEUE_SIZE)  # Очередь нажатий: по одному повороту на шаг
+        self.score = 0  # Начальный счёт
+
+    def paint(self, cell, value):
+        self.field[cell[0] * FIELD_SIZE + cell[1]] = value
+
+    def turn(self, direction):
+        """Ставим нажатие в очередь; True, если из-за него змейка поедет по-другому"""
+        planned = self.direction
+        for queued in self.inputs:  # Развороты на 180 градусов тик пропускает
+            if queued != (-planned[0], -planned[1]):
+                planned = queued
+        self.inputs.append(direction)
+        return direction != planned and direction != (-planned[0], -planned[1])
+
+@lru_cache(maxsize=1024)
+def render_row(row):
+    return ''.join(SPRITES[value] for value in row)
 
 def render_field(field, score):
-    return f"Очки: {score}\n```\n" + '\n'.join(''.join(row) for row in field) + "\n```"
+    rows = (render_row(bytes(field[i:i + FIELD_SIZE])) for i in range(0, len(field), FIELD_SIZE))
+    return f"Очки: {score}\n```\n" + '\n'.join(rows) + "\n```"
 
 def get_keyboard():
     buttons = [
@@ -50,80 +72,87 @@ def get_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-async def game_loop(bot, user_id):
-    logger.info(f"Entering game loop for user {user_id}")
+async def game_tick(bot, user_id):
+    """Один шаг змейки; возвращает интервал до следующего шага или None, если игра окончена"""
+    if user_id not in active_games or not active_games[user_id].running:
+        return None
     try:
-        while user_id in active_games and active_games[user_id].get("running", False):
-            game = active_games[user_id]
-            field = game["field"]
-            snake = game["snake"]
-            direction = game["direction"]
-            food = game["food"]
-            pending_direction = game["pending_direction"]
-            score = game["score"]
-            message_id = game["message_id"]
-
-            # Применяем отложенное направление, если есть
-            if pending_direction is not None:
-                new_direction = pending_direction
-                # Проверяем, не разворот ли это (180 градусов)
-                if (new_direction[0] != -direction[0] or new_direction[1] != -direction[1]):
-                    direction = new_direction
-                    logger.info(f"Applied pending direction for user {user_id}: {direction}")
-                else:
-                    logger.info(f"Ignored 180-degree turn for user {user_id}: {new_direction}")
-                game["pending_direction"] = None  # Сбрасываем буфер
-
-            logger.info(f"Processing move for user {user_id}")
-            head_x, head_y = snake[0]
-            dx, dy = direction
-            new_head = (head_x + dx, head_y + dy)
-
-            if (new_head[0] < 0 or new_head[0] >= FIELD_SIZE or 
-                new_head[1] < 0 or new_head[1] >= FIELD_SIZE or new_head in snake):
-                await bot.edit_message_text(
-                    chat_id=user_id,
-                    message_id=message_id,
-                    text=f"Игра окончена! Длина: {len(snake)}, Очки: {score}"
-                )
-                logger.info(f"Game over for user {user_id}: collision")
-                del active_games[user_id]
-                return
-
-            snake.insert(0, new_head)
-            if new_head == food:
-                score += 5  # Увеличиваем счёт при поедании еды
-                food = spawn_food(field, snake)
+        game = active_games[user_id]
+        snake = game.snake
+        direction = game.direction
+        inputs = game.inputs
+        score = game.score
+        message_id = game.message_id
+        key = game.key
+
+        # Сообщение больше нельзя править — завершаем игру; flood-wait — ставим на паузу
+        if pipeline.failed(key):
+            await pipeline.close(key)
+            del active_games[user_id]
+            return None
+        blocked = pipeline.blocked(key)
+        if blocked:
+            return blocked
+
+        # Применяем первое нажатие из очереди
+        if inputs:
+            new_direction = inputs.popleft()
+            # Проверяем, не разворот ли это (180 градусов)
+            if (new_direction[0] != -direction[0] or new_direction[1] != -direction[1]):
+                direction = new_direction
+                logger.info(f"Applied queued direction for user {user_id}: {direction}")
             else:
-                tail = snake.pop()
-                field[tail[0]][tail[1]] = EMPTY
-
-            field[new_head[0]][new_head[1]] = SNAKE
-            field[food[0]][food[1]] = FOOD
-
-            game["field"] = field
-            game["snake"] = snake
-            game["direction"] = direction
-            game["food"] = food
-            game["score"] = score
-
-            try:
-                await bot.edit_message_text(
-                    chat_id=user_id,
-                    message_id=message_id,
-                    text=render_field(field, score),
-                    reply_markup=get_keyboard()
-                )
-                logger.info(f"Updated field for user {user_id}")
-            except TelegramBadRequest as e:
-                logger.warning(f"Failed to update message for user {user_id}: {str(e)}")
-                del active_games[user_id]
-                return
-
-            await asyncio.sleep(MOVE_INTERVAL)
+                logger.info(f"Ignored 180-degree turn for user {user_id}: {new_direction}")
+
+        logger.info(f"Processing move for user {user_id}")
+        result = snake.step(direction)
+
+        if result == Snake.DEAD:
+            await pipeline.close(key)
+            await bot.edit_message_text(
+                chat_id=user_id,
+                message_id=message_id,
+                text=f"Игра окончена! Длина: {len(snake)}, Очки: {score}"
+            )
+            logger.info(f"Game over for user {user_id}: collision")
+            del active_games[user_id]
+            return None
+
+        if result in (Snake.ATE, Snake.WON):
+            score += 5  # Увеличиваем счёт при поедании еды
+        if snake.tail is not None:
+            game.paint(snake.tail, 0)
+        game.paint(snake.head, 1)
+
+        if result == Snake.WON:
+            await pipeline.close(key)
+            await bot.edit_message_text(
+                chat_id=user_id,
+                message_id=message_id,
+                text=f"🏆 Победа! Змейка заняла всё поле! Длина: {len(snake)}, Очки: {score}"
+            )
+            logger.info(f"Game won for user {user_id}: field is full")
+            del active_games[user_id]
+            return None
+
+        game.paint(snake.food, 2)
+
+        game.direction = direction
+        game.score = score
+
+        # Кадр уходит через общий конвейер правок: устаревшие и одинаковые кадры не отправляются
+        text = render_field(game.field, score)
+        pipeline.submit(key, text, lambda: bot.edit_message_text(
+            chat_id=user_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=get_keyboard()
+        ))
+
+        return pipeline.interval(key, MOVE_INTERVAL)
     except Exception as e:
-        logger.error(f"Game loop crashed for user {user_id}: {str(e)}")
-    logger.info(f"Game loop ended for user {user_id}")
+        logger.error(f"Game tick crashed for user {user_id}: {str(e)}")
+        return None
 
 @router.message(lambda message: message.text == "🐍 Змейка")
 async def snake_start(message: Message):
@@ -131,32 +160,26 @@ async def snake_start(message: Message):
     logger.info(f"Starting Snake for user {user_id}")
     
     if user_id in active_games:
-        active_games[user_id]["running"] = False
-        await asyncio.sleep(0.1)
+        old_game = active_games[user_id]
+        old_game.running = False
+        scheduler.remove(old_game.key)
+        await pipeline.close(old_game.key)
     
-    field, snake, direction, food, pending_direction, score = init_game()
+    game = SnakeSession(user_id)
     try:
         msg = await message.answer(
-            render_field(field, score),
+            render_field(game.field, game.score),
             reply_markup=get_keyboard()
         )
     except Exception as e:
         logger.error(f"Failed to send initial field for user {user_id}: {str(e)}")
         return
     
-    active_games[user_id] = {
-        "field": field,
-        "snake": snake,
-        "direction": direction,
-        "food": food,
-        "pending_direction": pending_direction,
-        "score": score,
-        "message_id": msg.message_id,
-        "running": True
-    }
+    game.message_id = msg.message_id
+    active_games[user_id] = game
     
-    logger.info(f"Creating game loop task for user {user_id}")
-    asyncio.create_task(game_loop(message.bot, user_id))
+    logger.info(f"Scheduling game ticks for user {user_id}")
+    scheduler.add(game.key, lambda: game_tick(message.bot, user_id), MOVE_INTERVAL)
     await message.answer(
         "Змейка запущена!\n"
         "🟩 - змейка, 🟥 - еда, ⬜ - пусто\n"
@@ -168,11 +191,13 @@ async def snake_start(message: Message):
 async def snake_stop(callback: CallbackQuery):
     user_id = callback.from_user.id
     game = active_games[user_id]
-    game["running"] = False
+    game.running = False
+    scheduler.remove(game.key)
+    await pipeline.close(game.key)
     await callback.bot.edit_message_text(
         chat_id=user_id,
-        message_id=game["message_id"],
-        text=f"Игра окончена! Длина змейки: {len(game['snake'])}, Очки: {game['score']}"
+        message_id=game.message_id,
+        text=f"Игра окончена! Длина змейки: {len(game.snake)}, Очки: {game.score}"
     )
     await callback.answer()
     del active_games[user_id]
@@ -189,8 +214,11 @@ async def snake_move(callback: CallbackQuery):
     }
     
     if callback.data in direction_map:
-        game["pending_direction"] = direction_map[callback.data]
-        logger.info(f"Pending direction changed for user {user_id} to {callback.data}")
+        # Поворот виден только после шага — делаем шаг досрочно, не дожидаясь тика.
+        # Нажатие, которое ничего не меняет, игру не ускоряет
+        if game.turn(direction_map[callback.data]):
+            scheduler.wake(game.key, MIN_TURN_SPACING)
+        logger.info(f"Direction queued for user {user_id}: {callback.data}")
     await callback.answer()
 
 if __name__ == "__main__":
@@ -1,67 +1,54 @@
 # handlers/snake_v2.py
 from aiogram import Router
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile, InputMediaPhoto
-from aiogram.exceptions import TelegramBadRequest
-import random
-import asyncio
 import logging
-from PIL import Image, ImageDraw
-import io
+from collections import deque
+from snake_engine import Snake
+from snake_render import SnakeCanvas
+from sessions import Session
+from tick_scheduler import scheduler
+from edit_pipeline import pipeline
 
 router = Router()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-FIELD_SIZE = 10
-CELL_SIZE = 20  # Размер клетки в пикселях
+FIELD_SIZE = 10  # Можно увеличивать: ход змейки и выбор еды не зависят от размера поля
 MOVE_INTERVAL = 1.0
+MIN_TURN_SPACING = 0.4  # Нажатие двигает змейку сразу, но не чаще, чем раз в столько секунд
+INPUT_QUEUE_SIZE = 3  # Сколько нажатий помним, если игрок жмёт быстрее, чем змейка ходит
 
-active_games = {}
-
-def init_game():
-    field = [[0 for _ in range(FIELD_SIZE)] for _ in range(FIELD_SIZE)]  # 0 - пусто, 1 - змейка, 2 - еда
-    snake = [(FIELD_SIZE//2, FIELD_SIZE//2)]
-    field[snake[0][0]][snake[0][1]] = 1
-    direction = (0, 1)
-    food = spawn_food(field, snake)
-    return field, snake, direction, food
-
-def spawn_food(field, snake):
-    while True:
-        x = random.randint(0, FIELD_SIZE-1)
-        y = random.randint(0, FIELD_SIZE-1)
-        if (x, y) not in snake:
-            field[x][y] = 2
-            return (x, y)
-
-def render_field(field):
-    img = Image.new('RGB', (FIELD_SIZE * CELL_SIZE, FIELD_SIZE * CELL_SIZE), color='white')
-    draw = ImageDraw.Draw(img)
-    
-    for y in range(FIELD_SIZE):
-        for x in range(FIELD_SIZE):
-            if field[y][x] == 1:  # Змейка
-                draw.rectangle(
-                    [x * CELL_SIZE, y * CELL_SIZE, (x + 1) * CELL_SIZE - 1, (y + 1) * CELL_SIZE - 1],
-                    fill='green'
-                )
-            elif field[y][x] == 2:  # Еда
-                draw.rectangle(
-                    [x * CELL_SIZE, y * CELL_SIZE, (x + 1) * CELL_SIZE - 1, (y + 1) * CELL_SIZE - 1],
-                    fill='red'
-                )
-            else:  # Пусто
-                draw.rectangle(
-                    [x * CELL_SIZE, y * CELL_SIZE, (x + 1) * CELL_SIZE - 1, (y + 1) * CELL_SIZE - 1],
-                    fill='white',
-                    outline='gray'
-                )
-    
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    return buf.getvalue()
+active_games = {}  # {user_id: SnakeV2Session}
+
+class SnakeV2Session(Session):
+    """Игра в Змейку v2.0: поле — bytearray FIELD_SIZE×FIELD_SIZE (0 - пусто, 1 - змейка, 2 - еда)"""
+
+    __slots__ = ("field", "snake", "direction", "inputs", "canvas")
+    kind = "snake_v2"
+
+    def __init__(self, user_id):
+        super().__init__(user_id)
+        self.field = bytearray(FIELD_SIZE * FIELD_SIZE)
+        self.snake = snake = Snake(FIELD_SIZE)
+        self.paint(snake.head, 1)
+        self.paint(snake.food, 2)
+        self.direction = (0, 1)
+        self.inputs = deque(maxlen=INPUT_QUEUE_SIZE)  # Очередь нажатий: по одному повороту на шаг
+        self.canvas = SnakeCanvas(FIELD_SIZE)
+
+    def paint(self, cell, value):
+        self.field[cell[0] * FIELD_SIZE + cell[1]] = value
+
+    def turn(self, direction):
+        """Ставим нажатие в очередь; True, если из-за него змейка поедет по-другому"""
+        planned = self.inputs[-1] if self.inputs else self.direction
+        self.inputs.append(direction)
+        return direction != planned
+
+    def frame(self):
+        """Снимок поля для SnakeCanvas"""
+        return bytes(self.field)
 
 def get_keyboard():
     buttons = [
@@ -73,66 +60,82 @@ def get_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-async def game_loop(bot, user_id):
-    logger.info(f"Entering game loop for user {user_id}")
+async def game_tick(bot, user_id):
+    """Один шаг змейки; возвращает интервал до следующего шага или None, если игра окончена"""
+    if user_id not in active_games or not active_games[user_id].running:
+        return None
     try:
-        while user_id in active_games and active_games[user_id].get("running", False):
-            game = active_games[user_id]
-            field = game["field"]
-            snake = game["snake"]
-            direction = game["direction"]
-            food = game["food"]
-            message_id = game["message_id"]
-
-            logger.info(f"Processing move for user {user_id}")
-            head_x, head_y = snake[0]
-            dx, dy = direction
-            new_head = (head_x + dx, head_y + dy)
-
-            if (new_head[0] < 0 or new_head[0] >= FIELD_SIZE or 
-                new_head[1] < 0 or new_head[1] >= FIELD_SIZE or new_head in snake):
-                await bot.edit_message_media(
-                    chat_id=user_id,
-                    message_id=message_id,
-                    media=InputMediaPhoto(media=BufferedInputFile(render_field(field), filename="game_over.png")),
-                    reply_markup=None
-                )
-                await bot.send_message(chat_id=user_id, text=f"Игра окончена! Длина: {len(snake)}")
-                logger.info(f"Game over for user {user_id}: collision")
-                del active_games[user_id]
-                return
-
-            snake.insert(0, new_head)
-            if new_head == food:
-                food = spawn_food(field, snake)
-            else:
-                tail = snake.pop()
-                field[tail[0]][tail[1]] = 0
-
-            field[new_head[0]][new_head[1]] = 1
-            field[food[0]][food[1]] = 2
-
-            game["field"] = field
-            game["snake"] = snake
-            game["food"] = food
-
-            try:
-                await bot.edit_message_media(
-                    chat_id=user_id,
-                    message_id=message_id,
-                    media=InputMediaPhoto(media=BufferedInputFile(render_field(field), filename="snake.png")),
-                    reply_markup=get_keyboard()
-                )
-                logger.info(f"Updated field for user {user_id}")
-            except TelegramBadRequest as e:
-                logger.warning(f"Failed to update message for user {user_id}: {str(e)}")
-                del active_games[user_id]
-                return
-
-            await asyncio.sleep(MOVE_INTERVAL)
+        game = active_games[user_id]
+        snake = game.snake
+        if game.inputs:
+            game.direction = game.inputs.popleft()
+        direction = game.direction
+        message_id = game.message_id
+        canvas = game.canvas
+        key = game.key
+
+        # Сообщение больше нельзя править — завершаем игру; flood-wait — ставим на паузу
+        if pipeline.failed(key):
+            await pipeline.close(key)
+            del active_games[user_id]
+            return None
+        blocked = pipeline.blocked(key)
+        if blocked:
+            return blocked
+
+        logger.info(f"Processing move for user {user_id}")
+        result = snake.step(direction)
+
+        if result == Snake.DEAD:
+            await pipeline.close(key)
+            await bot.edit_message_media(
+                chat_id=user_id,
+                message_id=message_id,
+                media=InputMediaPhoto(media=BufferedInputFile(await canvas.render_async(game.frame()), filename="game_over.png")),
+                reply_markup=None
+            )
+            await bot.send_message(chat_id=user_id, text=f"Игра окончена! Длина: {len(snake)}")
+            logger.info(f"Game over for user {user_id}: collision")
+            del active_games[user_id]
+            return None
+
+        if snake.tail is not None:
+            game.paint(snake.tail, 0)
+        game.paint(snake.head, 1)
+
+        if result == Snake.WON:
+            await pipeline.close(key)
+            await bot.edit_message_media(
+                chat_id=user_id,
+                message_id=message_id,
+                media=InputMediaPhoto(media=BufferedInputFile(await canvas.render_async(game.frame()), filename="game_over.png")),
+                reply_markup=None
+            )
+            await bot.send_message(chat_id=user_id, text=f"🏆 Победа! Змейка заняла всё поле! Длина: {len(snake)}")
+            logger.info(f"Game won for user {user_id}: field is full")
+            del active_games[user_id]
+            return None
+
+        game.paint(snake.food, 2)
+
+        # Кадр — снимок поля: картинка рисуется только для кадра, который действительно уйдёт в Telegram
+        frame = game.frame()
+
+        async def send():
+            photo = await canvas.render_async(frame)
+            await bot.edit_message_media(
+                chat_id=user_id,
+                message_id=message_id,
+                media=InputMediaPhoto(media=BufferedInputFile(photo, filename="snake.png")),
+                reply_markup=get_keyboard()
+            )
+
+        pipeline.submit(key, frame, send)
+
+        return pipeline.interval(key, MOVE_INTERVAL)
     except Exception as e:
-        logger.error(f"Game loop crashed for user {user_id}: {str(e)}")
-    logger.info(f"Game loop ended for user {user_id}")
+        logger.error(f"Game tick crashed for user {user_id}: {str(e)}")
+        return None
 
 @router.message(lambda message: message.text == "🐍 Змейка v2.0")
 async def snake_start(message: Message):
@@ -140,30 +143,26 @@ async def snake_start(message: Message):
     logger.info(f"Starting Snake v2.0 for user {user_id}")
     
     if user_id in active_games:
-        active_games[user_id]["running"] = False
-        await asyncio.sleep(0.1)
+        old_game = active_games[user_id]
+        old_game.running = False
+        scheduler.remove(old_game.key)
+        await pipeline.close(old_game.key)
     
-    field, snake, direction, food = init_game()
+    game = SnakeV2Session(user_id)
     try:
         msg = await message.answer_photo(
-            photo=BufferedInputFile(render_field(field), filename="snake.png"),
+            photo=BufferedInputFile(await game.canvas.render_async(game.frame()), filename="snake.png"),
             reply_markup=get_keyboard()
         )
     except Exception as e:
         logger.error(f"Failed to send initial photo for user {user_id}: {str(e)}")
         return
     
-    active_games[user_id] = {
-        "field": field,
-        "snake": snake,
-        "direction": direction,
-        "food": food,
-        "message_id": msg.message_id,
-        "running": True
-    }
+    game.message_id = msg.message_id
+    active_games[user_id] = game
     
-    logger.info(f"Creating game loop task for user {user_id}")
-    asyncio.create_task(game_loop(message.bot, user_id))
+    logger.info(f"Scheduling game ticks for user {user_id}")
+    scheduler.add(game.key, lambda: game_tick(message.bot, user_id), MOVE_INTERVAL)
     await message.answer(
         "Змейка v2.0 запущена!\n"
         "Зеленый - змейка, красный - еда\n"
@@ -175,13 +174,15 @@ async def snake_start(message: Message):
 async def snake_stop(callback: CallbackQuery):
     user_id = callback.from_user.id
     game = active_games[user_id]
-    game["running"] = False
+    game.running = False
+    scheduler.remove(game.key)
+    await pipeline.close(game.key)
     await callback.bot.edit_message_media(
         chat_id=user_id,
-        message_id=game["message_id"],
-        media=InputMediaPhoto(media=BufferedInputFile(render_field(game["field"]), filename="game_over.png"))
+        message_id=game.message_id,
+        media=InputMediaPhoto(media=BufferedInputFile(await game.canvas.render_async(game.frame()), filename="game_over.png"))
     )
-    await callback.bot.send_message(chat_id=user_id, text=f"Игра окончена! Длина змейки: {len(game['snake'])}")
+    await callback.bot.send_message(chat_id=user_id, text=f"Игра окончена! Длина змейки: {len(game.snake)}")
     await callback.answer()
     del active_games[user_id]
     logger.info(f"Game stopped by user {user_id}")
@@ -197,6 +198,9 @@ async def snake_move(callback: CallbackQuery):
     }
     
     if callback.data in direction_map:
-        game["direction"] = direction_map[callback.data]
-        logger.info(f"Direction changed for user {user_id} to {callback.data}")
+        # Поворот виден только после шага — делаем шаг досрочно, не дожидаясь тика.
+        # Нажатие, которое ничего не меняет, игру не ускоряет
+        if game.turn(direction_map[callback.data]):
+            scheduler.wake(game.key, MIN_TURN_SPACING)
+        logger.info(f"Direction queued for user {user_id}: {callback.data}")
     await callback.answer()
\ No newline at end of file
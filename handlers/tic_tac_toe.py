@@ -3,47 +3,88 @@ from aiogram import Router, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 import random
+from functools import lru_cache
+from tic_tac_toe_engine import best_move, get_spec, search_move_async
+from sessions import Session
 
 router = Router()
 
-games = {}  # {chat_id: {"board": [[0, 0, 0], [0, 0, 0], [0, 0, 0]], "difficulty": "easy/hard/impossible"}}
+# {chat_id: TicTacToeSession}
+games = {}
 
-def render_board(board):
-    """Создает игровое поле с кнопками"""
+# Доступные поля: (размер, сколько в ряд для победы)
+BOARD_OPTIONS = [(3, 3), (4, 4), (5, 4), (7, 5)]
+
+# Сколько готовых клавиатур держим в общем кэше (все позиции 3×3 помещаются целиком)
+BOARD_CACHE_SIZE = 8192
+
+class TicTacToeSession(Session):
+    """Партия в крестики-нолики: x и o — битовые маски клеток игрока и бота"""
+
+    __slots__ = ("x", "o", "size", "win_length", "difficulty", "thinking")
+    kind = "tic_tac_toe"
+
+    def __init__(self, chat_id, size, win_length, difficulty):
+        super().__init__(chat_id)
+        self.x = 0
+        self.o = 0
+        self.size = size
+        self.win_length = win_length
+        self.difficulty = difficulty  # "easy", "hard" или "impossible"
+        self.thinking = False
+
+@lru_cache(maxsize=BOARD_CACHE_SIZE)
+def render_board(x, o, size):
+    """Создает игровое поле с кнопками.
+
+    Клавиатуры одинаковых позиций общие для всех чатов: кэш LRU по (x, o, size),
+    счётчики попаданий и промахов — render_board.cache_info().
+    """
     buttons = []
-    symbols = {0: "⬜", 1: "❌", 2: "⭕"}
-
-    for i in range(3):
-        row_buttons = [
-            InlineKeyboardButton(
-                text=symbols[board[i][j]], callback_data=f"move_{i}_{j}"
-            ) for j in range(3)
-        ]
+
+    for i in range(size):
+        row_buttons = []
+        for j in range(size):
+            k = i * size + j
+            symbol = "❌" if x >> k & 1 else "⭕" if o >> k & 1 else "⬜"
+            row_buttons.append(InlineKeyboardButton(text=symbol, callback_data=f"move_{k}"))
         buttons.append(row_buttons)
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 @router.message(lambda message: message.text == "❌ Крестики-нолики")
-async def select_difficulty(message: types.Message):
+async def select_size(message: types.Message):
+    """Запрашивает размер поля"""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"{size}×{size}, {win_length} в ряд", callback_data=f"size_{size}_{win_length}")]
+        for size, win_length in BOARD_OPTIONS
+    ])
+    await message.answer("Выбери поле:", reply_markup=keyboard)
+
+@router.callback_query(lambda c: c.data.startswith("size_"))
+async def select_difficulty(callback_query: types.CallbackQuery):
     """Запрашивает выбор уровня сложности"""
+    _, size, win_length = callback_query.data.split("_")
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="😎 Легкий", callback_data="difficulty_easy")],
-        [InlineKeyboardButton(text="🤖 Сложный", callback_data="difficulty_hard")],
-        [InlineKeyboardButton(text="💀 Невозможный", callback_data="difficulty_impossible")]
+        [InlineKeyboardButton(text="😎 Легкий", callback_data=f"difficulty_easy_{size}_{win_length}")],
+        [InlineKeyboardButton(text="🤖 Сложный", callback_data=f"difficulty_hard_{size}_{win_length}")],
+        [InlineKeyboardButton(text="💀 Невозможный", callback_data=f"difficulty_impossible_{size}_{win_length}")]
     ])
-    await message.answer("Выбери уровень сложности:", reply_markup=keyboard)
+    await callback_query.message.edit_text("Выбери уровень сложности:", reply_markup=keyboard)
 
 @router.callback_query(lambda c: c.data.startswith("difficulty_"))
 async def start_game(callback_query: types.CallbackQuery):
     """Начинает игру с выбранной сложностью"""
-    difficulty = callback_query.data.split("_")[1]  # "easy", "hard" или "impossible"
-    board = [[0] * 3 for _ in range(3)]
-    games[callback_query.message.chat.id] = {"board": board, "difficulty": difficulty}
+    _, difficulty, size, win_length = callback_query.data.split("_")  # "easy", "hard" или "impossible"
+    size, win_length = int(size), int(win_length)
+    chat_id = callback_query.message.chat.id
+    games[chat_id] = TicTacToeSession(chat_id, size, win_length, difficulty)
 
     difficulty_text = {"easy": "Легкий", "hard": "Сложный", "impossible": "Невозможный"}
     await callback_query.message.edit_text(
-        f"Начинаем игру! Сложность: {difficulty_text[difficulty]}\nТы ходишь первым. Выбери клетку:",
-        reply_markup=render_board(board)
+        f"Начинаем игру! Поле {size}×{size}, {win_length} в ряд. Сложность: {difficulty_text[difficulty]}\n"
+        "Ты ходишь первым. Выбери клетку:",
+        reply_markup=render_board(0, 0, size)
     )
 
 @router.callback_query(lambda c: c.data.startswith("move_"))
@@ -55,140 +96,93 @@ async def player_move(callback_query: types.CallbackQuery):
         return
 
     game = games[user_id]
-    board = game["board"]
-    _, row, col = callback_query.data.split("_")
-    row, col = int(row), int(col)
+    if game.thinking:
+        await callback_query.answer("Бот думает, подожди!")
+        return
 
-    if board[row][col] != 0:
+    spec = get_spec(game.size, game.win_length)
+    k = int(callback_query.data.split("_")[1])
+    if not 0 <= k < spec.cells:  # Кнопка со старого поля другого размера
+        await callback_query.answer("Это поле от прошлой игры, ходи на текущем!")
+        return
+    cell = 1 << k
+
+    if (game.x | game.o) & cell:
         await callback_query.answer("Эта клетка уже занята!")
         return
 
-    board[row][col] = 1  # Ход игрока (крестик)
+    game.x |= cell  # Ход игрока (крестик)
+    x, o = game.x, game.o
 
-    if check_winner(board, 1):
+    if spec.is_win(x):
         await callback_query.message.edit_text("🎉 Ты победил!", reply_markup=None)
         del games[user_id]
         return
 
-    if is_draw(board):
+    if spec.is_full(x, o):
         await callback_query.message.edit_text("🤝 Ничья!", reply_markup=None)
         del games[user_id]
         return
 
     # Ход бота (в зависимости от сложности)
-    if game["difficulty"] == "easy":
-        random_bot_move(board)
-    elif game["difficulty"] == "hard":
-        smart_bot_move(board)
+    if game.difficulty == "easy":
+        move = random_bot_move(x, o, spec)
+    elif game.difficulty == "hard":
+        move = smart_bot_move(x, o, spec)
     else:  # impossible
-        minimax_bot_move(board)
+        game.thinking = True
+        try:
+            move = await minimax_bot_move(x, o, spec)
+        finally:
+            game.thinking = False
+        if games.get(user_id) is not game:  # Пока бот думал, игру перезапустили
+            return
+    o = game.o = o | 1 << move
 
-    if check_winner(board, 2):
+    if spec.is_win(o):
         await callback_query.message.edit_text("😢 Бот победил!", reply_markup=None)
         del games[user_id]
         return
 
-    await callback_query.message.edit_text("Твой ход:", reply_markup=render_board(board))
+    if spec.is_full(x, o):
+        await callback_query.message.edit_text("🤝 Ничья!", reply_markup=None)
+        del games[user_id]
+        return
+
+    await callback_query.message.edit_text("Твой ход:", reply_markup=render_board(x, o, spec.size))
 
-def random_bot_move(board):
+def random_bot_move(x, o, spec):
     """Простой бот с рандомными ходами"""
-    empty_cells = [(i, j) for i in range(3) for j in range(3) if board[i][j] == 0]
-    if empty_cells:
-        row, col = random.choice(empty_cells)
-        board[row][col] = 2  # Ход бота (нолик)
+    return random.choice(spec.empty_cells(x, o))
 
-def smart_bot_move(board):
+def smart_bot_move(x, o, spec):
     """AI для бота: пытается победить, блокировать игрока или ходит оптимально"""
-    empty_cells = [(i, j) for i in range(3) for j in range(3) if board[i][j] == 0]
+    cells = spec.empty_cells(x, o)
 
     # 1️⃣ Проверяем, может ли бот выиграть
-    for row, col in empty_cells:
-        board[row][col] = 2
-        if check_winner(board, 2):
-            return
-        board[row][col] = 0
+    for k in cells:
+        if spec.wins_with(o, k):
+            return k
 
     # 2️⃣ Проверяем, может ли игрок выиграть, и блокируем его
-    for row, col in empty_cells:
-        board[row][col] = 1
-        if check_winner(board, 1):
-            board[row][col] = 2
-            return
-        board[row][col] = 0
+    for k in cells:
+        if spec.wins_with(x, k):
+            return k
 
     # 3️⃣ Ходим в центр, если он свободен
-    if board[1][1] == 0:
-        board[1][1] = 2
-        return
+    if spec.center in cells:
+        return spec.center
 
     # 4️⃣ Ходим в один из углов (если свободен)
-    for row, col in [(0, 0), (0, 2), (2, 0), (2, 2)]:
-        if board[row][col] == 0:
-            board[row][col] = 2
-            return
+    for k in spec.corners:
+        if k in cells:
+            return k
 
     # 5️⃣ Если ничего не получилось, делаем случайный ход
-    row, col = random.choice(empty_cells)
-    board[row][col] = 2
-
-def minimax_bot_move(board):
-    """Невозможный бот с алгоритмом МинМакс"""
-    best_score = float('-inf')
-    best_move = None
-    for i in range(3):
-        for j in range(3):
-            if board[i][j] == 0:
-                board[i][j] = 2  # Пробуем ход бота
-                score = minimax(board, 0, False)
-                board[i][j] = 0  # Откатываем ход
-                if score > best_score:
-                    best_score = score
-                    best_move = (i, j)
-    if best_move:
-        board[best_move[0]][best_move[1]] = 2
-
-def minimax(board, depth, is_maximizing):
-    """Алгоритм МинМакс для оценки хода"""
-    if check_winner(board, 2):  # Бот победил
-        return 10 - depth
-    if check_winner(board, 1):  # Игрок победил
-        return -10 + depth
-    if is_draw(board):  # Ничья
-        return 0
-
-    if is_maximizing:  # Ход бота (максимизируем)
-        best_score = float('-inf')
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == 0:
-                    board[i][j] = 2
-                    score = minimax(board, depth + 1, False)
-                    board[i][j] = 0
-                    best_score = max(score, best_score)
-        return best_score
-    else:  # Ход игрока (минимизируем)
-        best_score = float('inf')
-        for i in range(3):
-            for j in range(3):
-                if board[i][j] == 0:
-                    board[i][j] = 1
-                    score = minimax(board, depth + 1, True)
-                    board[i][j] = 0
-                    best_score = min(score, best_score)
-        return best_score
-
-def check_winner(board, player):
-    """Проверка победителя"""
-    for row in board:
-        if all(cell == player for cell in row):
-            return True
-    for col in range(3):
-        if all(board[row][col] == player for row in range(3)):
-            return True
-    if all(board[i][i] == player for i in range(3)) or all(board[i][2 - i] == player for i in range(3)):
-        return True
-    return False
-
-def is_draw(board):
-    """Проверка на ничью"""
-    return all(cell != 0 for row in board for cell in row)
\ No newline at end of file
+    return random.choice(cells)
+
+async def minimax_bot_move(x, o, spec):
+    """Невозможный бот: на 3×3 — ход из заранее решённой таблицы, иначе перебор в отдельном процессе"""
+    if spec.size == 3:
+        return best_move(x, o)
+    return await search_move_async(spec.size, spec.win_length, x, o)
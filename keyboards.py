@@ -32,4 +32,22 @@ start_cities_keyboard = ReplyKeyboardMarkup(
     ],
     resize_keyboard=True,
     one_time_keyboard=True,
+)
+
+cities_difficulty_keyboard = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="🎲 Обычный"), KeyboardButton(text="⭐ Известные города")],
+        [KeyboardButton(text="🧠 Сложный")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
+# Для наборов без данных о населении (города мира) режима «Известные города» нет
+cities_basic_difficulty_keyboard = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="🎲 Обычный"), KeyboardButton(text="🧠 Сложный")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True,
 )
\ No newline at end of file
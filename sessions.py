@@ -0,0 +1,27 @@
+# sessions.py
+
+
+class Session:
+    """Общая часть сессии игры: чей это сеанс, какое сообщение правим и идёт ли игра.
+
+    Сессии всех игр — классы с __slots__: без __dict__ на каждый объект и с
+    доступом к полям по атрибуту вместо строковых ключей. kind — имя игры;
+    key — ключ сессии в tick_scheduler и edit_pipeline.
+    """
+
+    __slots__ = ("user_id", "message_id", "running")
+    kind = "game"
+
+    def __init__(self, user_id, message_id=None):
+        self.user_id = user_id
+        self.message_id = message_id
+        self.running = True
+
+    @property
+    def key(self):
+        return (self.kind, self.user_id)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name, None)!r}" for cls in type(self).__mro__
+                           for name in getattr(cls, "__slots__", ()))
+        return f"{type(self).__name__}({fields})"
@@ -0,0 +1,117 @@
+# sessions_bench.py
+"""Замер: змейка 10×10 в прежнем виде (словарь, поле — списки строк) и в виде сессии со слотами.
+
+Запуск: python sessions_bench.py
+"""
+import time
+import tracemalloc
+from collections import deque
+
+from sessions import Session
+from snake_engine import Snake
+
+_FIELD_SIZE = 10
+_SPRITES = ("⬜", "🟩", "🟥")
+
+
+class _SnakeSession(Session):
+    __slots__ = ("field", "snake", "direction", "inputs", "score")
+    kind = "snake"
+
+
+def _dict_session(user_id):
+    field = [[_SPRITES[0] for _ in range(_FIELD_SIZE)] for _ in range(_FIELD_SIZE)]
+    snake = Snake(_FIELD_SIZE)
+    field[snake.head[0]][snake.head[1]] = _SPRITES[1]
+    field[snake.food[0]][snake.food[1]] = _SPRITES[2]
+    return {"field": field, "snake": snake, "direction": (0, 1), "inputs": deque(maxlen=3), "score": 0,
+            "message_id": user_id, "running": True}
+
+
+def _slots_session(user_id):
+    session = _SnakeSession(user_id, user_id)
+    session.field = bytearray(_FIELD_SIZE * _FIELD_SIZE)
+    session.snake = snake = Snake(_FIELD_SIZE)
+    session.field[snake.head[0] * _FIELD_SIZE + snake.head[1]] = 1
+    session.field[snake.food[0] * _FIELD_SIZE + snake.food[1]] = 2
+    session.direction = (0, 1)
+    session.inputs = deque(maxlen=3)
+    session.score = 0
+    return session
+
+
+def _dict_tick(game):
+    field = game["field"]
+    snake = game["snake"]
+    direction = game["direction"]
+    inputs = game["inputs"]
+    score = game["score"]
+    if inputs:
+        direction = inputs.popleft()
+    result = snake.step(direction)
+    if result == Snake.DEAD:
+        return False
+    if snake.tail is not None:
+        field[snake.tail[0]][snake.tail[1]] = _SPRITES[0]
+    field[snake.head[0]][snake.head[1]] = _SPRITES[1]
+    field[snake.food[0]][snake.food[1]] = _SPRITES[2]
+    game["direction"] = direction
+    game["score"] = score + (result == Snake.ATE)
+    game["field"] = field
+    return True
+
+
+def _slots_tick(session):
+    field = session.field
+    snake = session.snake
+    if session.inputs:
+        session.direction = session.inputs.popleft()
+    result = snake.step(session.direction)
+    if result == Snake.DEAD:
+        return False
+    if snake.tail is not None:
+        field[snake.tail[0] * _FIELD_SIZE + snake.tail[1]] = 0
+    field[snake.head[0] * _FIELD_SIZE + snake.head[1]] = 1
+    field[snake.food[0] * _FIELD_SIZE + snake.food[1]] = 2
+    session.score += result == Snake.ATE
+    return True
+
+
+def _measure(make, tick, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [make(user_id) for user_id in range(count)]
+    size = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+
+    turns = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    ticks = 0
+    started = time.perf_counter()
+    for round_number in range(20):
+        for i, session in enumerate(sessions):
+            if not tick(session):
+                sessions[i] = session = make(i)
+            if (i + round_number) % 3 == 0:
+                (session["inputs"] if isinstance(session, dict) else session.inputs).append(turns[(i + round_number) % 4])
+            ticks += 1
+    return size, (time.perf_counter() - started) / ticks
+
+
+def benchmark(count=10_000):
+    """Байт на сессию и время тика: словарь со списками строк против сессии со слотами и bytearray"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    snakes = [Snake(_FIELD_SIZE) for _ in range(count)]
+    engine_size = (tracemalloc.get_traced_memory()[0] - before) / len(snakes)
+    tracemalloc.stop()
+    print(f"snake_engine.Snake alone: {engine_size:,.0f} bytes")
+
+    for name, make, tick in (("dict + list of lists", _dict_session, _dict_tick),
+                             ("__slots__ + bytearray", _slots_session, _slots_tick)):
+        size, tick_time = _measure(make, tick, count)
+        print(f"{name}: {size:,.0f} bytes/session ({size - engine_size:,.0f} without Snake), "
+              f"{tick_time * 1e6:.2f} µs/tick ({count} sessions)")
+
+
+if __name__ == "__main__":
+    benchmark()
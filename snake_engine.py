@@ -0,0 +1,85 @@
+# snake_engine.py
+import random
+from collections import deque
+
+
+class FreeCells:
+    """Свободные клетки поля: добавление, удаление и случайный выбор за O(1)"""
+
+    __slots__ = ("_cells", "_positions")
+
+    def __init__(self, cells):
+        self._cells = list(cells)
+        self._positions = {cell: i for i, cell in enumerate(self._cells)}
+
+    def __len__(self):
+        return len(self._cells)
+
+    def add(self, cell):
+        self._positions[cell] = len(self._cells)
+        self._cells.append(cell)
+
+    def remove(self, cell):
+        index = self._positions.pop(cell)
+        last = self._cells.pop()
+        if index < len(self._cells):
+            self._cells[index] = last
+            self._positions[last] = index
+
+    def choice(self):
+        return random.choice(self._cells) if self._cells else None
+
+
+class Snake:
+    """Змейка на поле field_size×field_size.
+
+    body — deque клеток от головы к хвосту, occupied — множество тех же
+    клеток для проверки столкновений, free — клетки без змейки, из которых
+    еда выбирается за O(1). После step() в head/tail лежат клетки, которые
+    изменились: новая голова и освободившийся хвост (None, если змейка выросла).
+    """
+
+    __slots__ = ("field_size", "head", "tail", "body", "occupied", "free", "food")
+
+    MOVED, ATE, DEAD, WON = "moved", "ate", "dead", "won"
+
+    def __init__(self, field_size):
+        self.field_size = field_size
+        self.head = (field_size // 2, field_size // 2)
+        self.tail = None
+        self.body = deque([self.head])
+        self.occupied = {self.head}
+        self.free = FreeCells((x, y) for x in range(field_size) for y in range(field_size) if (x, y) != self.head)
+        self.food = self.spawn_food()
+
+    def __len__(self):
+        return len(self.body)
+
+    def spawn_food(self):
+        """Еда на случайной свободной клетке или None, если поле занято целиком"""
+        self.food = self.free.choice()
+        return self.food
+
+    def step(self, direction):
+        """Сдвигаем змейку на клетку: MOVED, ATE, DEAD (стена или хвост) или WON (поле заполнено)"""
+        head_x, head_y = self.body[0]
+        new_head = (head_x + direction[0], head_y + direction[1])
+        if (not 0 <= new_head[0] < self.field_size or not 0 <= new_head[1] < self.field_size
+                or new_head in self.occupied):
+            return self.DEAD
+
+        self.body.appendleft(new_head)
+        self.occupied.add(new_head)
+        self.free.remove(new_head)
+        self.head = new_head
+
+        if new_head == self.food:
+            self.tail = None
+            if self.spawn_food() is None:
+                return self.WON
+            return self.ATE
+
+        self.tail = self.body.pop()
+        self.occupied.discard(self.tail)
+        self.free.add(self.tail)
+        return self.MOVED
@@ -0,0 +1,144 @@
+# snake_render.py
+import asyncio
+import io
+import random
+import sys
+import threading
+import time
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+from snake_engine import Snake
+
+CELL_SIZE = 20  # Размер клетки в пикселях
+PNG_COMPRESS_LEVEL = 9  # Картинка маленькая: максимальное сжатие почти ничего не стоит
+
+# Палитра: 0 - фон, 1 - сетка, 2 - змейка, 3 - еда
+PALETTE = [
+    255, 255, 255,
+    128, 128, 128,
+    0, 128, 0,
+    255, 0, 0,
+]
+EMPTY, SNAKE, FOOD = 0, 1, 2  # Значения клеток поля, как в handlers/snake_v2.py
+
+
+@lru_cache(maxsize=None)
+def get_tiles(cell_size):
+    """Заранее нарисованные клетки: пустая с сеткой, змейка и еда"""
+    tiles = []
+    for fill, outline in ((0, 1), (2, None), (3, None)):
+        tile = Image.new("P", (cell_size, cell_size), fill)
+        tile.putpalette(PALETTE)
+        if outline is not None:
+            ImageDraw.Draw(tile).rectangle([0, 0, cell_size - 1, cell_size - 1], fill=fill, outline=outline)
+        tiles.append(tile)
+    return tiles
+
+
+class SnakeCanvas:
+    """Картинка поля одной игры, которая перерисовывается по изменившимся клеткам.
+
+    Кадр — bytes со значениями клеток построчно (см. field_frame). render()
+    сравнивает его с последним нарисованным, вставляет готовые клетки только
+    туда, где значение поменялось (обычно голова, хвост и еда), и кодирует
+    PNG с палитрой из четырёх цветов.
+    """
+
+    def __init__(self, field_size, cell_size=CELL_SIZE):
+        self.field_size = field_size
+        self.cell_size = cell_size
+        self.tiles = get_tiles(cell_size)
+        self.image = Image.new("P", (field_size * cell_size, field_size * cell_size), 0)
+        self.image.putpalette(PALETTE)
+        self.cells = bytearray([255]) * (field_size * field_size)  # Ещё ничего не нарисовано
+        self._lock = threading.Lock()  # render_async может ещё идти в потоке, когда игра уже закончилась
+
+    def render(self, frame):
+        with self._lock:
+            cells, tiles, size, cell_size = self.cells, self.tiles, self.field_size, self.cell_size
+            for k, value in enumerate(frame):
+                if cells[k] != value:
+                    cells[k] = value
+                    y, x = divmod(k, size)
+                    self.image.paste(tiles[value], (x * cell_size, y * cell_size))
+            buf = io.BytesIO()
+            self.image.save(buf, format="PNG", bits=2, compress_level=PNG_COMPRESS_LEVEL)
+            return buf.getvalue()
+
+    async def render_async(self, frame):
+        """render() в пуле потоков, чтобы кодирование PNG не блокировало event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.render, frame)
+
+
+def field_frame(field):
+    """Снимок поля (список строк) в виде кадра для SnakeCanvas"""
+    return bytes(value for row in field for value in row)
+
+
+def _render_draw(field, cell_size=CELL_SIZE):
+    """Прежний рендер: новая RGB-картинка и все клетки через ImageDraw на каждый кадр"""
+    size = len(field)
+    img = Image.new('RGB', (size * cell_size, size * cell_size), color='white')
+    draw = ImageDraw.Draw(img)
+    for y in range(size):
+        for x in range(size):
+            box = [x * cell_size, y * cell_size, (x + 1) * cell_size - 1, (y + 1) * cell_size - 1]
+            if field[y][x] == SNAKE:
+                draw.rectangle(box, fill='green')
+            elif field[y][x] == FOOD:
+                draw.rectangle(box, fill='red')
+            else:
+                draw.rectangle(box, fill='white', outline='gray')
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _play_frames(field_size, count):
+    """Кадры случайной игры змейкой (с перезапуском после смерти)"""
+    rng = random.Random(1)
+    random.seed(1)
+    directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    frames = []
+    while len(frames) < count:
+        snake = Snake(field_size)
+        field = [[EMPTY] * field_size for _ in range(field_size)]
+        field[snake.head[0]][snake.head[1]] = SNAKE
+        field[snake.food[0]][snake.food[1]] = FOOD
+        direction = (0, 1)
+        while len(frames) < count:
+            if rng.random() < 0.3:
+                direction = rng.choice(directions)
+            result = snake.step(direction)
+            if result in (Snake.DEAD, Snake.WON):
+                break
+            if snake.tail is not None:
+                field[snake.tail[0]][snake.tail[1]] = EMPTY
+            field[snake.head[0]][snake.head[1]] = SNAKE
+            field[snake.food[0]][snake.food[1]] = FOOD
+            frames.append([row[:] for row in field])
+    return frames
+
+
+def benchmark(field_size=10, count=2000):
+    """Кадров в секунду на одно ядро и байт на кадр: прежний рендер против SnakeCanvas"""
+    frames = _play_frames(field_size, count)
+
+    started = time.perf_counter()
+    old_bytes = sum(len(_render_draw(field)) for field in frames)
+    old_time = time.perf_counter() - started
+
+    canvas = SnakeCanvas(field_size)
+    started = time.perf_counter()
+    new_bytes = sum(len(canvas.render(field_frame(field))) for field in frames)
+    new_time = time.perf_counter() - started
+
+    print(f"{field_size}x{field_size}, {count} frames")
+    print(f"ImageDraw + RGB PNG: {count / old_time:.0f} fps/core, {old_bytes / count:.0f} bytes/frame")
+    print(f"tiles + palette PNG: {count / new_time:.0f} fps/core, {new_bytes / count:.0f} bytes/frame")
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark()
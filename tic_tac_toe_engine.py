@@ -0,0 +1,383 @@
+# tic_tac_toe_engine.py
+import asyncio
+import logging
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Поле хранится двумя битовыми масками: x — клетки игрока, o — клетки бота.
+# Бит k соответствует клетке (k // size, k % size).
+MAX_SIZE = 7
+MOVE_TIME_BUDGET = 2.0  # Сколько секунд бот думает над ходом на больших полях
+SEARCH_WORKERS = 2  # Процессы для перебора, чтобы не блокировать event loop
+TT_MAX_ENTRIES = 1_000_000  # Размер кэша позиций в процессе перебора
+WIN_SCORE = 1_000_000
+
+
+class BoardSpec:
+    """Геометрия поля size×size с победой при win_length в ряд.
+
+    lines — маски всех выигрышных отрезков, cell_lines — отрезки через
+    каждую клетку (после хода проверяем только их), neighbours — маски
+    соседних клеток для отбора кандидатов в переборе.
+    """
+
+    def __init__(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full_mask = (1 << self.cells) - 1
+        self.center = (size // 2) * size + size // 2
+        self.corners = (0, size - 1, self.cells - size, self.cells - 1)
+        self.lines = []
+        for i in range(size):
+            for j in range(size):
+                for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_i, end_j = i + di * (win_length - 1), j + dj * (win_length - 1)
+                    if 0 <= end_i < size and 0 <= end_j < size:
+                        self.lines.append(sum(1 << ((i + di * t) * size + j + dj * t) for t in range(win_length)))
+        self.cell_lines = [[line for line in self.lines if line >> k & 1] for k in range(self.cells)]
+        self.neighbours = []
+        for k in range(self.cells):
+            i, j = divmod(k, size)
+            self.neighbours.append(sum(
+                1 << (ni * size + nj)
+                for ni in range(max(i - 1, 0), min(i + 2, size))
+                for nj in range(max(j - 1, 0), min(j + 2, size))
+                if (ni, nj) != (i, j)
+            ))
+        # Ближе к центру — раньше в переборе
+        self.cell_order = sorted(range(self.cells), key=lambda k: abs(k // size - size // 2) + abs(k % size - size // 2))
+        rng = random.Random(size * 100 + win_length)  # Одинаковые ключи во всех процессах
+        self.zobrist = [(rng.getrandbits(64), rng.getrandbits(64)) for _ in range(self.cells)]
+
+    def is_win(self, bits):
+        """Есть ли у стороны win_length в ряд"""
+        for line in self.lines:
+            if bits & line == line:
+                return True
+        return False
+
+    def wins_with(self, bits, cell):
+        """Даёт ли ход в клетку победу (проверяем только отрезки через неё)"""
+        bits |= 1 << cell
+        for line in self.cell_lines[cell]:
+            if bits & line == line:
+                return True
+        return False
+
+    def is_full(self, x, o):
+        return x | o == self.full_mask
+
+    def empty_cells(self, x, o):
+        free = ~(x | o) & self.full_mask
+        return [k for k in range(self.cells) if free >> k & 1]
+
+
+@lru_cache(maxsize=None)
+def get_spec(size, win_length):
+    if not 3 <= win_length <= size <= MAX_SIZE:
+        raise ValueError(f"Unsupported board {size}x{size} with {win_length} in a row")
+    return BoardSpec(size, win_length)
+
+
+CLASSIC = get_spec(3, 3)
+
+
+# --- 3×3: заранее решённая таблица ходов ---
+
+def _rotate(perm):
+    """Поворот на 90° по часовой: клетка (i, j) берётся из (2 - j, i)"""
+    return tuple(perm[(2 - j) * 3 + i] for i in range(3) for j in range(3))
+
+
+def _mirror(perm):
+    return tuple(perm[i * 3 + (2 - j)] for i in range(3) for j in range(3))
+
+
+def _symmetries():
+    """8 симметрий поля: клетка k преобразованного поля берётся из клетки perm[k]"""
+    perms, perm = [], tuple(range(9))
+    for _ in range(4):
+        perms += [perm, _mirror(perm)]
+        perm = _rotate(perm)
+    return perms
+
+
+SYMMETRIES = _symmetries()
+# Для каждой симметрии — таблица {9-битная маска: преобразованная маска}
+SYMMETRY_TABLES = [
+    [sum(1 << k for k in range(9) if bits >> perm[k] & 1) for bits in range(CLASSIC.full_mask + 1)]
+    for perm in SYMMETRIES
+]
+
+
+def canonical(x, o):
+    """Каноническая позиция среди 8 симметрий и перестановка клеток, которая к ней приводит"""
+    return min(((table[x], table[o]), perm) for table, perm in zip(SYMMETRY_TABLES, SYMMETRIES))
+
+
+def _bit_count(bits):
+    return bin(bits).count("1")
+
+
+def _solve(x, o, values, moves):
+    """Минимакс с запоминанием по каноническим позициям.
+
+    Оценка как у прежнего перебора: 10 - число ходов до победы бота,
+    -10 + число ходов до победы игрока, 0 — ничья. Для позиций, где ходит
+    бот, в moves запоминается лучший ход в канонической системе координат.
+    """
+    key = (x, o)
+    if key in values:
+        return values[key]
+    if CLASSIC.is_win(o):
+        score = 10
+    elif CLASSIC.is_win(x):
+        score = -10
+    elif CLASSIC.is_full(x, o):
+        score = 0
+    else:
+        bot_turn = _bit_count(x) > _bit_count(o)  # Игрок ходит первым
+        best_score, best_move = None, None
+        for k in CLASSIC.empty_cells(x, o):
+            child = (x, o | 1 << k) if bot_turn else (x | 1 << k, o)
+            child_score = _solve(*canonical(*child)[0], values, moves)
+            child_score -= 1 if child_score > 0 else -1 if child_score < 0 else 0  # Ход дальше от финала
+            if best_score is None or (child_score > best_score if bot_turn else child_score < best_score):
+                best_score, best_move = child_score, k
+        score = best_score
+        if bot_turn:
+            moves[key] = best_move
+    values[key] = score
+    return score
+
+
+def build_solution_table():
+    """Лучший ход бота для каждой достижимой позиции (с точностью до симметрии)"""
+    started = time.perf_counter()
+    values, moves = {}, {}
+    for k in range(9):  # Игрок ходит первым
+        _solve(*canonical(1 << k, 0)[0], values, moves)
+    logger.info(f"Tic-tac-toe solution table built in {time.perf_counter() - started:.3f}s: {len(moves)} positions")
+    return moves
+
+
+SOLUTION_TABLE = build_solution_table()
+
+
+def best_move(x, o):
+    """Оптимальный ход бота на 3×3: индекс клетки 0..8 или None, если ходить некуда"""
+    (canonical_x, canonical_o), perm = canonical(x, o)
+    move = SOLUTION_TABLE.get((canonical_x, canonical_o))
+    return None if move is None else perm[move]
+
+
+# --- Большие поля: альфа-бета с итеративным углублением ---
+
+class _Timeout(Exception):
+    pass
+
+
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+_tables = {}  # {(size, win_length): {zobrist-ключ: (глубина, оценка, флаг, лучший ход)}}
+
+
+class _Search:
+    """Негамакс с альфа-бета отсечением, кэшем позиций по ключу Зобриста и лимитом времени"""
+
+    def __init__(self, spec, deadline):
+        self.spec = spec
+        self.deadline = deadline
+        self.nodes = 0
+        self.table = _tables.setdefault((spec.size, spec.win_length), {})
+        if len(self.table) > TT_MAX_ENTRIES:
+            self.table.clear()
+
+    def evaluate(self, mine, theirs):
+        """Эвристика: незаблокированные отрезки, вес растёт с числом своих фишек"""
+        score = 0
+        for line in self.spec.lines:
+            if not line & theirs:
+                score += 4 ** _bit_count(line & mine)
+            elif not line & mine:
+                score -= 4 ** _bit_count(line & theirs)
+        return score
+
+    def candidates(self, mine, theirs, first):
+        """Свободные клетки рядом с фишками, ход из кэша — первым"""
+        spec = self.spec
+        taken = mine | theirs
+        if not taken:
+            return [spec.center]
+        near = 0
+        for k in range(spec.cells):
+            if taken >> k & 1:
+                near |= spec.neighbours[k]
+        near &= ~taken
+        moves = [k for k in spec.cell_order if near >> k & 1]
+        if not moves:  # Рядом с фишками всё занято — берём любые свободные
+            moves = [k for k in spec.cell_order if not taken >> k & 1]
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        return moves
+
+    def negamax(self, mine, theirs, key, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.monotonic() > self.deadline:
+            raise _Timeout
+        spec = self.spec
+        if spec.is_full(mine, theirs):
+            return 0, None
+        if depth == 0:
+            return self.evaluate(mine, theirs), None
+
+        original_alpha = alpha
+        entry = self.table.get(key)
+        first = None
+        if entry is not None:
+            entry_depth, entry_score, flag, first = entry
+            if entry_depth >= depth:
+                if flag == _EXACT:
+                    return entry_score, first
+                if flag == _LOWER:
+                    alpha = max(alpha, entry_score)
+                elif flag == _UPPER:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score, first
+
+        moves = self.candidates(mine, theirs, first)
+        side = ply & 1
+        # Сначала ищем немедленную победу: это и самый сильный ход, и самый дешёвый
+        for k in moves:
+            if spec.wins_with(mine, k):
+                return WIN_SCORE - ply, k
+
+        best_score, best_move = -WIN_SCORE * 2, moves[0]
+        for k in moves:
+            child_key = key ^ spec.zobrist[k][side]
+            score = -self.negamax(theirs, mine | 1 << k, child_key, depth - 1, -beta, -alpha, ply + 1)[0]
+            if score > best_score:
+                best_score, best_move = score, k
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+
+        flag = _UPPER if best_score <= original_alpha else _LOWER if best_score >= beta else _EXACT
+        self.table[key] = (depth, best_score, flag, best_move)
+        return best_score, best_move
+
+
+def _zobrist_key(spec, x, o):
+    key = 0
+    for k in range(spec.cells):
+        if x >> k & 1:
+            key ^= spec.zobrist[k][1]
+        elif o >> k & 1:
+            key ^= spec.zobrist[k][0]
+    return key
+
+
+def search_move(size, win_length, x, o, time_budget=MOVE_TIME_BUDGET):
+    """Ход бота за o на поле size×size: итеративное углубление до исчерпания времени"""
+    spec = get_spec(size, win_length)
+    cells = spec.empty_cells(x, o)
+    if not cells:
+        return None
+    # Выигрываем сразу или закрываем немедленную угрозу без перебора
+    for bits in (o, x):
+        for k in cells:
+            if spec.wins_with(bits, k):
+                return k
+
+    started = time.monotonic()
+    search = _Search(spec, started + time_budget)
+    key = _zobrist_key(spec, x, o)
+    best, depth = cells[0], 0
+    while depth < len(cells):
+        depth += 1
+        try:
+            score, move = search.negamax(o, x, key, depth, -WIN_SCORE * 2, WIN_SCORE * 2, 0)
+        except _Timeout:
+            break
+        if move is not None:
+            best = move
+        if abs(score) >= WIN_SCORE - depth:
+            break  # Исход уже известен
+    logger.info(f"Search {size}x{size}/{win_length}: depth {depth}, {search.nodes} nodes, "
+                f"{time.monotonic() - started:.2f}s")
+    return best
+
+
+_executor = None
+
+
+async def search_move_async(size, win_length, x, o, time_budget=MOVE_TIME_BUDGET):
+    """search_move в отдельном процессе, чтобы большие поля не блокировали других игроков"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=SEARCH_WORKERS)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, search_move, size, win_length, x, o, time_budget)
+
+
+# --- Бенчмарк ---
+
+def _search_bits(x, o, bot_turn):
+    """Полный перебор 3×3 без отсечений и кэша на битовых масках"""
+    if CLASSIC.is_win(o):
+        return 1
+    if CLASSIC.is_win(x):
+        return -1
+    if CLASSIC.is_full(x, o):
+        return 0
+    scores = [
+        _search_bits(x, o | 1 << k, False) if bot_turn else _search_bits(x | 1 << k, o, True)
+        for k in CLASSIC.empty_cells(x, o)
+    ]
+    return max(scores) if bot_turn else min(scores)
+
+
+def _search_lists(board, bot_turn):
+    """Тот же перебор на списке списков, как в прежнем minimax"""
+    def wins(player):
+        return (any(all(cell == player for cell in row) for row in board)
+                or any(all(board[i][j] == player for i in range(3)) for j in range(3))
+                or all(board[i][i] == player for i in range(3))
+                or all(board[i][2 - i] == player for i in range(3)))
+
+    if wins(2):
+        return 1
+    if wins(1):
+        return -1
+    if all(cell != 0 for row in board for cell in row):
+        return 0
+    scores = []
+    for i in range(3):
+        for j in range(3):
+            if board[i][j] == 0:
+                board[i][j] = 2 if bot_turn else 1
+                scores.append(_search_lists(board, not bot_turn))
+                board[i][j] = 0
+    return max(scores) if bot_turn else min(scores)
+
+
+def benchmark():
+    """Полный перебор дерева игры после первого хода игрока в центр"""
+    started = time.perf_counter()
+    _search_lists([[0, 0, 0], [0, 1, 0], [0, 0, 0]], True)
+    lists_time = time.perf_counter() - started
+    started = time.perf_counter()
+    _search_bits(1 << 4, 0, True)
+    bits_time = time.perf_counter() - started
+    print(f"list of lists: {lists_time:.3f}s, bitboards: {bits_time:.3f}s ({lists_time / bits_time:.1f}x)")
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark()
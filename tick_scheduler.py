@@ -0,0 +1,166 @@
+# tick_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from edit_pipeline import pipeline
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT = 50  # Сколько тиков (правок сообщений) выполняется одновременно
+LAG_WINDOW = 1000  # По скольким последним тикам считаем статистику задержки
+STATS_INTERVAL = 60  # Как часто пишем статистику в лог (сек)
+
+
+class TickScheduler:
+    """Общий планировщик тиков для всех игр реального времени.
+
+    Вместо отдельной задачи с asyncio.sleep на каждого игрока — одна куча
+    сроков по time.monotonic(). Сессия — корутина tick(), которая делает
+    один шаг игры и возвращает интервал до следующего шага (или None, чтобы
+    остановиться). Следующий срок считается от прошлого срока, а не от
+    конца тика, поэтому задержка Telegram API не накапливается. Тики одной
+    сессии не перекрываются, а одновременно выполняется не больше
+    max_in_flight тиков всех сессий. wake() переносит следующий тик на
+    «сейчас» — так нажатие кнопки обрабатывается, не дожидаясь срока.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self._heap = []        # [(срок, номер, ключ, поколение)]
+        self._sessions = {}    # {ключ: (поколение, tick, интервал, срок)}
+        self._last_tick = {}   # {ключ: время начала последнего тика}
+        self._running = {}     # {ключ: минимальный интервал досрочного тика} для выполняемых тиков
+        self._generations = itertools.count()
+        self._order = itertools.count()
+        self._wakeup = None
+        self._semaphore = None
+        self._task = None
+        self._in_flight = 0
+        self._ticks = 0
+        self._lags = deque(maxlen=LAG_WINDOW)
+
+    def add(self, key, tick, interval):
+        """Регистрируем сессию (заменяя прежнюю с тем же ключом); первый тик — через interval"""
+        generation = next(self._generations)
+        deadline = time.monotonic() + interval
+        self._sessions[key] = (generation, tick, interval, deadline)
+        self._last_tick.pop(key, None)
+        self._push(deadline, key, generation)
+        self._ensure_running()
+
+    def remove(self, key):
+        """Останавливаем сессию: её тики, уже лежащие в куче, будут пропущены"""
+        self._sessions.pop(key, None)
+        self._last_tick.pop(key, None)
+
+    def wake(self, key, min_spacing=0.0):
+        """Досрочный тик сессии: сейчас, но не раньше чем через min_spacing после прошлого тика"""
+        session = self._sessions.get(key)
+        if session is None:
+            return
+        if key in self._running:
+            # Тик уже идёт — следующий поставим досрочно, когда он закончится
+            self._running[key] = min(self._running[key], min_spacing)
+            return
+        generation, tick, interval, deadline = session
+        woken = max(time.monotonic(), self._last_tick.get(key, 0.0) + min_spacing)
+        if woken >= deadline:
+            return
+        generation = next(self._generations)
+        self._sessions[key] = (generation, tick, interval, woken)
+        self._push(woken, key, generation)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def _push(self, deadline, key, generation):
+        heapq.heappush(self._heap, (deadline, next(self._order), key, generation))
+        if self._wakeup is not None and self._heap[0][2] == key:
+            self._wakeup.set()  # Новый срок раньше того, которого ждёт цикл
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        last_stats = time.monotonic()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            deadline = self._heap[0][0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, _, key, generation = heapq.heappop(self._heap)
+            session = self._sessions.get(key)
+            if session is None or session[0] != generation:
+                continue  # Сессию остановили или перезапустили
+            await self._semaphore.acquire()
+            self._last_tick[key] = time.monotonic()
+            self._running[key] = float("inf")
+            self._lags.append(time.monotonic() - deadline)
+            self._ticks += 1
+            self._in_flight += 1
+            asyncio.create_task(self._tick(key, session, deadline))
+
+            now = time.monotonic()
+            if now - last_stats >= STATS_INTERVAL:
+                last_stats = now
+                logger.info(f"Tick scheduler stats: {self.stats()}, edit pipeline: {pipeline.stats()}")
+
+    async def _tick(self, key, session, deadline):
+        generation, tick, interval, _ = session
+        try:
+            next_interval = await tick()
+        except Exception as e:
+            logger.error(f"Tick failed for session {key}: {str(e)}")
+            next_interval = None
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            wake_spacing = self._running.pop(key, float("inf"))
+
+        current = self._sessions.get(key)
+        if current is None or current[0] != generation:
+            return
+        if next_interval is None:
+            del self._sessions[key]
+            self._last_tick.pop(key, None)
+            return
+        next_deadline = deadline + next_interval
+        now = time.monotonic()
+        if next_deadline < now - next_interval:
+            next_deadline = now  # Отстали больше чем на тик — не догоняем пачкой тиков
+        if wake_spacing != float("inf"):
+            next_deadline = min(next_deadline, max(now, self._last_tick[key] + wake_spacing))
+        self._sessions[key] = (generation, tick, next_interval, next_deadline)
+        self._push(next_deadline, key, generation)
+
+    def stats(self):
+        """Статистика: число сессий, тиков, выполняемых тиков и задержка тика относительно срока"""
+        lags = sorted(self._lags)
+        return {
+            "sessions": len(self._sessions),
+            "ticks": self._ticks,
+            "in_flight": self._in_flight,
+            "lag_avg_ms": round(sum(lags) / len(lags) * 1000, 1) if lags else 0.0,
+            "lag_p95_ms": round(lags[int(len(lags) * 0.95)] * 1000, 1) if lags else 0.0,
+            "lag_max_ms": round(lags[-1] * 1000, 1) if lags else 0.0,
+        }
+
+
+scheduler = TickScheduler()
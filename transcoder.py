@@ -0,0 +1,227 @@
+# transcoder.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько ffmpeg работает одновременно и сколько заданий ждут в очереди (дальше — отказ «сервер занят»)
+FFMPEG_WORKERS = int(os.environ.get("FFMPEG_WORKERS", max((os.cpu_count() or 2) // 2, 1)))
+FFMPEG_QUEUE_SIZE = int(os.environ.get("FFMPEG_QUEUE_SIZE", 20))
+BACKGROUND_SHARE = 0.5  # Какую долю очереди могут занять фоновые задания (заготовки раундов)
+FFMPEG_TIMEOUT = 60  # Максимальное время одного задания (сек)
+METRICS_WINDOW = 200  # По скольким последним заданиям считаем время ожидания и работы
+EXTRA_PIPES = os.name != "nt"  # Дополнительные каналы (pipe:N) процессу можно передать везде, кроме Windows
+
+
+class TranscoderBusy(Exception):
+    """Очередь заданий ffmpeg заполнена"""
+
+
+class Transcoder:
+    """Общий пул для заданий с ffmpeg: не больше workers процессов сразу.
+
+    Задание — корутина-функция, которая запускается, когда освободится
+    обработчик (обычно она режет уже скачанные байты через cut_clips).
+    В очереди ждёт не больше queue_size заданий: если она полна, submit()
+    сразу бросает TranscoderBusy, чтобы бот мог ответить «попробуй позже».
+    Фоновые задания (background=True) занимают не больше background_share
+    очереди, чтобы остальное место всегда оставалось тем, кого ждёт игрок.
+    Задание, которое работает дольше timeout, отменяется (ffmpeg при этом
+    убивается). Если тот, кто ждёт результат, отменён — задание тоже
+    отменяется или выбрасывается из очереди.
+    """
+
+    def __init__(self, workers=FFMPEG_WORKERS, queue_size=FFMPEG_QUEUE_SIZE, timeout=FFMPEG_TIMEOUT,
+                 background_share=BACKGROUND_SHARE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.background_limit = int(queue_size * background_share)
+        self.timeout = timeout
+        self._queue = None
+        self._tasks = []
+        self._running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failed = 0
+        self._waits = deque(maxlen=METRICS_WINDOW)
+        self._encodes = deque(maxlen=METRICS_WINDOW)
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def has_room(self, background=False):
+        """Примет ли очередь задание прямо сейчас"""
+        depth = self._queue.qsize() if self._queue is not None else 0
+        return depth < (self.background_limit if background else self.queue_size)
+
+    async def submit(self, job, background=False):
+        """Ставим задание в очередь и ждём результат; TranscoderBusy, если места нет"""
+        self._ensure_workers()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            if not self.has_room(background):
+                raise asyncio.QueueFull()
+            self._queue.put_nowait((job, future, time.monotonic()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning(f"Transcoder queue is full{' for background jobs' if background else ''}: {self.stats()}")
+            raise TranscoderBusy()
+        self.submitted += 1
+        return await future
+
+    async def _worker(self):
+        while True:
+            job, future, queued_at = await self._queue.get()
+            try:
+                if future.done():
+                    continue  # Тот, кто ждал, уже ушёл
+                started = time.monotonic()
+                self._waits.append(started - queued_at)
+                self._running += 1
+                task = asyncio.ensure_future(asyncio.wait_for(job(), self.timeout))
+                future.add_done_callback(lambda done, task=task: task.cancel() if done.cancelled() else None)
+                try:
+                    # wait() не бросает ошибки задания, поэтому отмена самого обработчика не путается с ними
+                    await asyncio.wait([task])
+                except asyncio.CancelledError:
+                    task.cancel()
+                    raise
+                finally:
+                    self._running -= 1
+                    self._encodes.append(time.monotonic() - started)
+                if future.done():
+                    continue
+                if task.cancelled():
+                    future.cancel()
+                elif isinstance(task.exception(), asyncio.TimeoutError):
+                    self.timeouts += 1
+                    logger.error(f"FFmpeg job timed out after {self.timeout}s")
+                    future.set_exception(task.exception())
+                elif task.exception() is not None:
+                    self.failed += 1
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        """Глубина очереди, число заданий и время ожидания/работы (среднее и p95, мс)"""
+        def summary(samples):
+            values = sorted(samples)
+            if not values:
+                return {"avg_ms": 0.0, "p95_ms": 0.0}
+            return {"avg_ms": round(sum(values) / len(values) * 1000, 1),
+                    "p95_ms": round(values[int(len(values) * 0.95)] * 1000, 1)}
+
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+            "wait": summary(self._waits),
+            "encode": summary(self._encodes),
+        }
+
+
+async def _read_pipe(file):
+    """Читаем канал до конца, не блокируя event loop"""
+    reader = asyncio.StreamReader()
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), file
+    )
+    try:
+        return await reader.read()
+    finally:
+        transport.close()
+
+
+async def run_ffmpeg(command, data, extra_outputs=()):
+    """Запускаем ffmpeg и подаём ему в stdin байты data.
+
+    extra_outputs — пары (чтение, запись) из os.pipe() для выходов pipe:N.
+    Возвращаем (код возврата, stdout, stderr, [байты дополнительных выходов]).
+    При отмене процесс убивается.
+    """
+    readers = [open(read_fd, "rb", buffering=0) for read_fd, _ in extra_outputs]
+    try:
+        kwargs = {"pass_fds": [write_fd for _, write_fd in extra_outputs]} if extra_outputs else {}
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                **kwargs
+            )
+        finally:
+            for _, write_fd in extra_outputs:
+                os.close(write_fd)  # Концы для записи остаются только у ffmpeg, иначе чтение не дождётся конца
+
+        async def feed():
+            try:
+                process.stdin.write(data)
+                await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg уже получил всё нужное и закрыл вход
+            finally:
+                process.stdin.close()
+
+        try:
+            _, stdout, stderr, *extra = await asyncio.gather(
+                feed(), process.stdout.read(), process.stderr.read(), *map(_read_pipe, readers)
+            )
+            await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        return process.returncode, stdout, stderr, extra
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+async def cut_clips(ffmpeg_path, data, segments, input_format=None):
+    """Режем из байтов data отрезки (начало, длительность) одним запуском ffmpeg.
+
+    input_format — формат входа для ffmpeg (-f); None — ffmpeg определит его сам.
+
+    Первый отрезок ffmpeg пишет в stdout, остальные — в дополнительные
+    каналы pipe:N, так что всё остаётся в памяти. На Windows передать
+    процессу дополнительные каналы нельзя — там каждый отрезок режется
+    отдельным запуском из тех же байтов. Возвращаем список байтов отрезков.
+    """
+    if len(segments) > 1 and not EXTRA_PIPES:
+        clips = []
+        for segment in segments:
+            clips += await cut_clips(ffmpeg_path, data, [segment], input_format)
+        return clips
+
+    extra_outputs = [os.pipe() for _ in segments[1:]]
+    outputs = ['pipe:1'] + [f'pipe:{write_fd}' for _, write_fd in extra_outputs]
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error']
+    if input_format:
+        command += ['-f', input_format]
+    command += ['-i', 'pipe:0']
+    for (start, duration), output in zip(segments, outputs):
+        command += ['-ss', str(start), '-t', str(duration), '-acodec', 'mp3', '-f', 'mp3', output]
+    returncode, stdout, stderr, extra = await run_ffmpeg(command, data, extra_outputs)
+    if returncode != 0:
+        raise RuntimeError(f"FFmpeg failed: {stderr.decode().strip()}")
+    return [stdout] + extra
+
+
+# Общий пул для всех обработчиков, которые запускают ffmpeg
+transcoder = Transcoder()
@@ -0,0 +1,157 @@
+# yandex_client.py
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from yandex_music import Client
+
+logger = logging.getLogger(__name__)
+
+YANDEX_WORKERS = 4  # Сколько запросов к Яндекс Музыке идёт одновременно
+SEARCH_TTL = 3600  # Сколько секунд помним результат поиска
+DOWNLOAD_LINK_TTL = 60  # Прямые ссылки подписаны и быстро протухают
+CACHE_MAX_ENTRIES = 1024
+LATENCY_WINDOW = 200  # По скольким последним вызовам считаем задержку
+# Адрес API можно подменить локальной заглушкой (например, в тестах)
+API_URL = os.environ.get("YANDEX_MUSIC_API_URL")
+
+
+class _TTLCache:
+    """Результаты запросов с временем жизни; одинаковые запросы в полёте объединяются"""
+
+    def __init__(self, ttl, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._values = {}     # {ключ: (истекает, значение)}
+        self._in_flight = {}  # {ключ: asyncio.Task}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, load):
+        cached = self._values.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            # Загрузка — отдельная задача: если один из ждущих отменён, остальные получат результат
+            task = asyncio.ensure_future(load())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._store(key, done))
+        else:
+            self.hits += 1
+        return await asyncio.shield(task)
+
+    def _store(self, key, task):
+        self._in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        now = time.monotonic()
+        if len(self._values) >= self.max_entries:
+            self._values = {k: v for k, v in self._values.items() if v[0] > now}
+            if len(self._values) >= self.max_entries:
+                self._values.pop(next(iter(self._values)))
+        self._values[key] = (now + self.ttl, task.result())
+
+
+class YandexMusic:
+    """Асинхронная обёртка над синхронным yandex_music.Client.
+
+    Клиент создаётся при первом запросе, а не при импорте. Каждый вызов
+    API выполняется в своём пуле из YANDEX_WORKERS потоков, поэтому
+    event loop (и тики игр) не ждут HTTP. Результаты поиска и прямые
+    ссылки кэшируются с TTL, для каждого вызова копится статистика задержки
+    (stats()). base_url позволяет направить клиент на локальную заглушку API.
+    """
+
+    def __init__(self, token, base_url=API_URL, workers=YANDEX_WORKERS,
+                 search_ttl=SEARCH_TTL, download_link_ttl=DOWNLOAD_LINK_TTL):
+        self.token = token
+        self.base_url = base_url
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yandex")
+        self._client = None
+        self._init_lock = None
+        self._searches = _TTLCache(search_ttl)
+        self._download_links = _TTLCache(download_link_ttl)
+        self._latency = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._errors = defaultdict(int)
+
+    async def _call(self, name, func, *args):
+        """Выполняем синхронный вызов в пуле потоков и записываем его задержку"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self._errors[name] += 1
+            raise
+        finally:
+            self._latency[name].append(time.perf_counter() - started)
+
+    async def client(self):
+        if self._client is None:
+            if self._init_lock is None:
+                self._init_lock = asyncio.Lock()
+            async with self._init_lock:
+                if self._client is None:
+                    kwargs = {"base_url": self.base_url} if self.base_url else {}
+                    self._client = await self._call("init", lambda: Client(self.token, **kwargs).init())
+                    logger.info("Yandex Music client initialized")
+        return self._client
+
+    async def search_track(self, query):
+        """Первый трек по запросу или None"""
+        async def load():
+            client = await self.client()
+            result = await self._call("search", lambda: client.search(query, type_="track"))
+            if not result.tracks or not result.tracks.results:
+                logger.warning(f"No results found for track: {query}")
+                return None
+            return result.tracks.results[0]
+
+        return await self._searches.get(query, load)
+
+    async def download_link(self, track):
+        """(прямая ссылка, кодек, битрейт в кбит/с, превью ли это) для трека или None.
+
+        Из вариантов загрузки берём полный трек в MP3, если он есть; дальше —
+        полный трек в другом кодеке, и только потом превью.
+        """
+        def fetch():
+            download_info = track.get_download_info()
+            if not download_info:
+                logger.warning(f"No download info available for track: {track.id}")
+                return None
+            info = min(download_info, key=lambda item: (bool(item.preview), item.codec != "mp3"))
+            link = info.get_direct_link()
+            if not link:
+                logger.warning(f"No direct link available for track: {track.id}")
+                return None
+            return link, info.codec, info.bitrate_in_kbps, bool(info.preview)
+
+        async def load():
+            await self.client()
+            return await self._call("download_link", fetch)
+
+        return await self._download_links.get(track.id, load)
+
+    def stats(self):
+        """Задержка вызовов API (среднее, p95, максимум, мс), ошибки и попадания в кэш"""
+        calls = {}
+        for name, samples in self._latency.items():
+            latencies = sorted(samples)
+            calls[name] = {
+                "calls": len(latencies),
+                "errors": self._errors[name],
+                "avg_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+                "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1),
+                "max_ms": round(latencies[-1] * 1000, 1),
+            }
+        return {
+            "calls": calls,
+            "search_cache": {"hits": self._searches.hits, "misses": self._searches.misses},
+            "download_link_cache": {"hits": self._download_links.hits, "misses": self._download_links.misses},
+        }